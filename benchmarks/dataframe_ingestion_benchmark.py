@@ -0,0 +1,56 @@
+# Benchmark of the ingestion of a parsed log (DataFrame) by the Aggregator.
+#
+# Compares the previous per-row iterrows()/to_dict() ingestion with
+# Aggregator._http_requests, which builds the requests from column lists.
+# Requests are built and grouped by (orig_ip, user-agent) as in training.
+#
+# Usage: python benchmarks/dataframe_ingestion_benchmark.py [log file]
+
+# Add sys.path variable such that we are able to import from parent directory
+import os
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.sys.path.insert(0, parentdir)
+
+import timeit
+from bro_parser import BroParser
+from decanter_new import Aggregator, HTTPRequest
+
+
+def legacy_ingest(data):
+    """ Previous implementation, kept here as the reference for the benchmark. """
+    aggregator = Aggregator()
+    for row in data.iterrows():
+        aggregator._insert_http_request(HTTPRequest(row[1].to_dict()))
+    return aggregator
+
+
+def ingest(data):
+    aggregator = Aggregator()
+    for h in aggregator._http_requests(data):
+        aggregator._insert_http_request(h)
+    return aggregator
+
+
+def clusters(aggregator):
+    return dict((host, dict((ua, [(r.ts, r.uri) for r in c]) for ua, c in uas.iteritems()))
+                for host, uas in aggregator.hosts_clusters.iteritems())
+
+
+def rows_per_second(ingestion, data, repeat=5):
+    timer = timeit.Timer(lambda: ingestion(data))
+    return len(data) / min(timer.repeat(repeat=repeat, number=1))
+
+
+if __name__ == '__main__':
+    filename = os.sys.argv[1] if len(os.sys.argv) > 1 else os.path.join(parentdir, 'test-data', 'malware', 'vm7_decanter.log')
+    data = BroParser().parseFile(filename)
+
+    # Both must build the same clusters before their speed is compared.
+    assert clusters(legacy_ingest(data)) == clusters(ingest(data))
+
+    before = rows_per_second(legacy_ingest, data)
+    after = rows_per_second(ingest, data)
+    print "Rows:   {}".format(len(data))
+    print "Before: {:.0f} rows/sec".format(before)
+    print "After:  {:.0f} rows/sec".format(after)
+    print "Speedup: {:.2f}x".format(after / before)
@@ -0,0 +1,60 @@
+# Registered domain of the Host headers, as computed for every request by FingerprintGenerator._parse.
+#
+# Compares the previous _parse (IPy for every hostname, an exception for
+# each one that is not an IP address) with domains.DomainNormalizer, on the
+# logs in test-data/user/log. Without a public suffix list both give the
+# last two labels. With a public suffix list file, the number of hostnames
+# whose registered domain is different is printed too.
+#
+# Usage: python benchmarks/domain_benchmark.py [public suffix list] [log files]
+
+# Add sys.path variable such that we are able to import from parent directory
+import os
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.sys.path.insert(0, parentdir)
+
+import glob
+import timeit
+from IPy import IP
+from bro_parser import BroParser
+from domains import DomainNormalizer
+
+
+def legacy_parse(hostname):
+    """ Previous implementation, kept here as the reference for the benchmark. """
+    try:
+        IP(hostname)
+        return hostname
+    except ValueError:
+        top_domains = ".".join(hostname.split('.')[-2:])
+        return top_domains
+
+
+def requests_per_second(parse, hosts, repeat=5):
+    timer = timeit.Timer(lambda: [parse(h) for h in hosts])
+    return len(hosts) / min(timer.repeat(repeat=repeat, number=1))
+
+
+if __name__ == '__main__':
+    suffix_file = os.sys.argv[1] if len(os.sys.argv) > 1 else None
+    files = os.sys.argv[2:] or sorted(glob.glob(os.path.join(parentdir, 'test-data', 'user', 'log', '*.log')))
+    hosts = [row['header_values']['host'] for row in BroParser('mmap').iterFile(files) if 'host' in row['header_values']]
+
+    # Both must agree before their speed is compared.
+    normalizer = DomainNormalizer()
+    for h in hosts:
+        assert legacy_parse(h) == normalizer.registered_domain(h), h
+
+    before = requests_per_second(legacy_parse, hosts)
+    after = requests_per_second(DomainNormalizer().registered_domain, hosts)
+    print "Requests: {} ({} hostnames)".format(len(hosts), len(set(hosts)))
+    print "Before: {:.0f} requests/sec".format(before)
+    print "After:  {:.0f} requests/sec".format(after)
+    print "Speedup: {:.2f}x".format(after / before)
+
+    if suffix_file is not None:
+        suffixes = DomainNormalizer(suffix_file)
+        changed = sorted(set(h for h in set(hosts) if suffixes.registered_domain(h) != legacy_parse(h)))
+        print "Hostnames with another registered domain with {}: {}".format(suffix_file, len(changed))
+        for h in changed[:20]:
+            print "    {} ---> {} (was {})".format(h, suffixes.registered_domain(h), legacy_parse(h))
@@ -0,0 +1,63 @@
+# Detection against a large trained model, in memory and in a FingerprintDatabase.
+#
+# The model is made like in fingerprint_store_benchmark.py. The testing
+# fingerprints of test-data/user/csv are tested against all the trained
+# fingerprints (a list, like Aggregator._trained_fingerprints), and against
+# the candidates read from the SQLite database.
+#
+# Usage: python benchmarks/fingerprint_db_benchmark.py [copies]
+
+# Add sys.path variable such that we are able to import from parent directory
+import os
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.sys.path.insert(0, parentdir)
+
+import glob
+import shutil
+import tempfile
+import time
+from detection import DetectionModule
+from fingerprint import FingerprintManager
+from fingerprint_db import FingerprintDatabase
+from fingerprint_store_benchmark import make_model
+
+
+def testing_fingerprints():
+    manager = FingerprintManager()
+    for f in sorted(glob.glob(os.path.join(parentdir, 'test-data', 'user', 'csv', '*testing*.csv'))):
+        manager.read_from_file(f)
+    return [f for fingerprints in manager.hosts_fingerprints.itervalues() for f in fingerprints]
+
+
+def detect(trained, fingerprints):
+    detector = DetectionModule()
+    start = time.time()
+    result = [detector.detection(trained, f) for f in fingerprints]
+    return result, (time.time() - start) / len(fingerprints)
+
+
+if __name__ == '__main__':
+    copies = int(os.sys.argv[1]) if len(os.sys.argv) > 1 else 1000
+    fingerprints = testing_fingerprints()
+    model = make_model(copies)
+    trained = [f for fps in model.hosts_fingerprints.itervalues() for f in fps]
+    folder = tempfile.mkdtemp()
+    try:
+        database = FingerprintDatabase(os.path.join(folder, 'fingerprints.db'))
+        start = time.time()
+        database.store_many((host, f) for host, fps in make_model(copies).hosts_fingerprints.iteritems() for f in fps)
+        insert = time.time() - start
+
+        before, before_time = detect(trained, fingerprints)
+        after, after_time = detect(database, fingerprints)
+        # Both must raise the same alerts before their speed is compared.
+        assert before == after
+
+        print "Fingerprints: {} trained, {} tested".format(len(trained), len(fingerprints))
+        print "Insert: {:.2f} s ({:.0f} fingerprints/sec)".format(insert, len(trained) / insert)
+        print "Before: {:.2f} ms/fingerprint".format(1000 * before_time)
+        print "After:  {:.2f} ms/fingerprint".format(1000 * after_time)
+        print "Speedup: {:.2f}x".format(before_time / after_time)
+        database.close()
+    finally:
+        shutil.rmtree(folder)
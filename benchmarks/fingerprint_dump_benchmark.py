@@ -0,0 +1,75 @@
+# Throughput of the testing fingerprints dumped in OFFLINE mode.
+#
+# Compares the previous write_fingerprint_to_file (open the CSV in append
+# mode, write one row and close it, for every fingerprint) with the
+# FingerprintWriter of FingerprintManager, in the calling thread and with a
+# background thread. The fingerprints are the ones of test-data/user/csv,
+# repeated.
+#
+# Usage: python benchmarks/fingerprint_dump_benchmark.py [fingerprints]
+
+# Add sys.path variable such that we are able to import from parent directory
+import os
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.sys.path.insert(0, parentdir)
+
+import csv
+import glob
+import shutil
+import tempfile
+import time
+from fingerprint import FingerprintManager
+
+
+def legacy_write_fingerprint_to_file(filename, fingerprint, host):
+    """ Previous implementation, kept here as the reference for the benchmark. """
+    if fingerprint is None:
+        return
+    ofile = open(filename, 'a')
+    writer = csv.writer(ofile, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+    input_csv = fingerprint.to_csv()
+    input_csv.append(host)
+    writer.writerow(input_csv)
+    ofile.close()
+
+
+def fingerprints(n):
+    manager = FingerprintManager()
+    for f in sorted(glob.glob(os.path.join(parentdir, 'test-data', 'user', 'csv', '*.csv'))):
+        manager.read_from_file(f)
+    result = [f for fps in manager.hosts_fingerprints.itervalues() for f in fps]
+    return [('10.0.{}.{}'.format(i / 256 % 256, i % 256), result[i % len(result)]) for i in range(n)]
+
+
+def dump_time(write, close, filename, items):
+    start = time.time()
+    for host, fingerprint in items:
+        write(filename, fingerprint, host)
+    close()
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    items = fingerprints(int(os.sys.argv[1]) if len(os.sys.argv) > 1 else 50000)
+    folder = tempfile.mkdtemp()
+    try:
+        before_file, after_file, thread_file = [os.path.join(folder, name + '.csv') for name in ('before', 'after', 'thread')]
+        before = dump_time(legacy_write_fingerprint_to_file, lambda: None, before_file, items)
+        manager = FingerprintManager()
+        after = dump_time(manager.write_fingerprint_to_file, manager.close_files, after_file, items)
+        manager = FingerprintManager(background=True)
+        thread = dump_time(manager.write_fingerprint_to_file, manager.close_files, thread_file, items)
+
+        # All the files must be the same before their speed is compared.
+        with open(before_file, 'rb') as f:
+            expected = f.read()
+        for name in (after_file, thread_file):
+            with open(name, 'rb') as f:
+                assert f.read() == expected, name
+
+        print "Fingerprints: {}".format(len(items))
+        print "Before: {:.0f} fingerprints/sec".format(len(items) / before)
+        print "After:  {:.0f} fingerprints/sec ({:.0f} with a background thread)".format(len(items) / after, len(items) / thread)
+        print "Speedup: {:.2f}x".format(before / after)
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,72 @@
+# Load time of the trained fingerprints read by OfflineDetector.
+#
+# Compares the CSV files (parsed with ast.literal_eval) with the binary
+# fingerprint files (fingerprint.BINARY_EXTENSION) holding the same
+# fingerprints. A large trained model is made by repeating the fingerprints
+# in test-data/user/csv, with hosts, destination IPs and user-agents renamed
+# for every copy (e.g., the model of a large network).
+#
+# Usage: python benchmarks/fingerprint_store_benchmark.py [copies]
+
+# Add sys.path variable such that we are able to import from parent directory
+import os
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.sys.path.insert(0, parentdir)
+
+import glob
+import shutil
+import tempfile
+import timeit
+from fingerprint import Fingerprint, FingerprintManager, BINARY_EXTENSION
+
+
+def make_model(copies):
+    """ FingerprintManager with copies of the fingerprints in test-data/user/csv. """
+    original = FingerprintManager()
+    for f in sorted(glob.glob(os.path.join(parentdir, 'test-data', 'user', 'csv', '*.csv'))):
+        original.read_from_file(f)
+    model = FingerprintManager()
+    for i in range(copies):
+        host = '10.{}.{}.{}'.format(i / 65536, i / 256 % 256, i % 256)
+        for fingerprints in original.hosts_fingerprints.itervalues():
+            for f in fingerprints:
+                model.store(host, Fingerprint(f.label, ['{} #{}'.format(ua, i) for ua in f.user_agent],
+                                              [('{}.{}'.format(i, name), count) for name, count in f.hosts],
+                                              ['{}.{}'.format(ip, i) for ip in f.ip_dsts], f.constant_header_fields,
+                                              f.language if f.label != "Background" else None, f.avg_size,
+                                              f.outgoing_info, f.method, f.is_malicious))
+    return model
+
+
+def load(filename):
+    m = FingerprintManager()
+    m.read_from_file(filename)
+    return m.hosts_fingerprints[filename]
+
+
+def load_time(filename, repeat=3):
+    return min(timeit.Timer(lambda: load(filename)).repeat(repeat=repeat, number=1))
+
+
+if __name__ == '__main__':
+    copies = int(os.sys.argv[1]) if len(os.sys.argv) > 1 else 1000
+    model = make_model(copies)
+    folder = tempfile.mkdtemp()
+    try:
+        csv_file = os.path.join(folder, 'training_fingerprints.csv')
+        binary_file = os.path.join(folder, 'training_fingerprints' + BINARY_EXTENSION)
+        model.write_to_file(csv_file)
+        model.write_to_file(binary_file)
+
+        # Both files must hold the same fingerprints before their load time is compared.
+        assert [f.__dict__ for f in load(csv_file)] == [f.__dict__ for f in load(binary_file)]
+
+        before = load_time(csv_file)
+        after = load_time(binary_file)
+        print "Fingerprints: {}".format(len(load(binary_file)))
+        print "Size:   {} bytes (CSV), {} bytes (binary)".format(os.path.getsize(csv_file), os.path.getsize(binary_file))
+        print "Before: {:.3f} s".format(before)
+        print "After:  {:.3f} s".format(after)
+        print "Speedup: {:.2f}x".format(before / after)
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,60 @@
+# Micro-benchmark of the header_values decoder.
+#
+# Compares the decoder that used to be copied in BroParser, ReferrerGraph and
+# dumont.bro_parser with header_decoder.parse_header_values, on the raw
+# header_values column of the logs in test-data/user/log.
+#
+# Usage: python benchmarks/header_decoder_benchmark.py [log files]
+
+# Add sys.path variable such that we are able to import from parent directory
+import os
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.sys.path.insert(0, parentdir)
+
+import glob
+import timeit
+from header_decoder import parse_header_values
+
+
+def legacy_parse_header_values(headerValues):
+    """ Previous implementation, kept here as the reference for the benchmark. """
+    try:
+        return dict((x, y) for x, y in list(map(lambda entry: (entry.split('||')[0].lower(), entry.split('||')[1].replace('\\x2c', ',')), headerValues.split(','))))
+    except:
+        return {}
+
+
+def read_header_column(filename):
+    """ Read the raw header_values column of a bro log file. """
+    column = None
+    values = []
+    with open(filename) as f:
+        for line in f:
+            if line.startswith('#fields'):
+                column = line.rstrip('\n').split('\t')[1:].index('header_values')
+            elif not line.startswith('#'):
+                values.append(line.rstrip('\n').split('\t')[column])
+    return values
+
+
+def rows_per_second(decoder, values, repeat=5):
+    timer = timeit.Timer(lambda: [decoder(v) for v in values])
+    return len(values) / min(timer.repeat(repeat=repeat, number=1))
+
+
+if __name__ == '__main__':
+    files = os.sys.argv[1:] or sorted(glob.glob(os.path.join(parentdir, 'test-data', 'user', 'log', '*.log')))
+    values = []
+    for f in files:
+        values.extend(read_header_column(f))
+
+    # Both decoders must agree before their speed is compared, malformed rows included.
+    for v in values + ['A,B||1||2', 'X||a||b,Y', 'A||1,B']:
+        assert legacy_parse_header_values(v) == parse_header_values(v), v
+
+    before = rows_per_second(legacy_parse_header_values, values)
+    after = rows_per_second(parse_header_values, values)
+    print "Rows:   {}".format(len(values))
+    print "Before: {:.0f} rows/sec".format(before)
+    print "After:  {:.0f} rows/sec".format(after)
+    print "Speedup: {:.2f}x".format(after / before)
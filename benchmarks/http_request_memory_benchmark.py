@@ -0,0 +1,88 @@
+# Memory used by the HTTP requests held by the Aggregator.
+#
+# Compares the previous HTTPRequest (old-style class with a __dict__, no
+# interning) with decanter_new.HTTPRequest, on the logs in test-data/user/log.
+# The size of a list of requests is the total size of the objects reachable
+# from it, counting every shared object (e.g., an interned string) once.
+#
+# Usage: python benchmarks/http_request_memory_benchmark.py [log files]
+
+# Add sys.path variable such that we are able to import from parent directory
+import os
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.sys.path.insert(0, parentdir)
+
+import glob
+import sys
+from urlparse import urlparse
+from bro_parser import BroParser
+from decanter_new import HTTPRequest, _precomputed
+
+
+class LegacyHTTPRequest():
+    """ Previous implementation, kept here as the reference for the benchmark. """
+
+    def __init__(self, http_req):
+        self.uid = http_req.get('uid', None)
+        self.ts = http_req.get('ts', None)
+        self.orig_ip = http_req.get('id.orig_h', None)
+        self.orig_port = http_req.get('id.orig_p', None)
+        self.dest_ip = http_req.get('id.resp_h', None)
+        self.dest_port = http_req.get('id.resp_p', None)
+        self.header_values = http_req.get('header_values', None)
+        self.uri = http_req.get('uri', None)
+        self.version = http_req.get('version', None)
+        self.method = http_req.get('method', None)
+        self.orig_mime_type = http_req.get('orig_mime_types', None)
+        self.req_body_len = http_req.get('request_body_len', 0)
+        self.is_malicious = http_req.get('is_malicious', None)
+        self.header_bytes = http_req.get('header_bytes', None)
+        self.host_domain = _precomputed(http_req.get('host_domain', None))
+        self.referer_domain = _precomputed(http_req.get('referer_domain', None))
+        self.uri_path = _precomputed(http_req.get('uri_path', None))
+        self.uri_query = _precomputed(http_req.get('uri_query', None))
+        if (self.uri_path is None or self.uri_query is None) and self.uri is not None:
+            parsed_uri = urlparse(self.uri)
+            self.uri_path = parsed_uri.path
+            self.uri_query = parsed_uri.query
+
+
+def deep_size(objects):
+    """ Total size of the objects reachable from objects, each counted once. """
+    seen = set()
+    size = 0
+    stack = list(objects)
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+        elif hasattr(o, '__dict__'):
+            stack.append(o.__dict__)
+        for name in getattr(type(o), '__slots__', ()):
+            stack.append(getattr(o, name, None))
+    return size
+
+
+def bytes_per_request(request_class, files):
+    # Parse the logs again for every class, so that the requests do not share
+    # the strings of the same parsed rows.
+    requests = [request_class(row) for row in BroParser('mmap').iterFile(files)]
+    return deep_size(requests) / float(len(requests)), len(requests)
+
+
+if __name__ == '__main__':
+    files = os.sys.argv[1:] or sorted(glob.glob(os.path.join(parentdir, 'test-data', 'user', 'log', '*.log')))
+
+    before, n = bytes_per_request(LegacyHTTPRequest, files)
+    after, _ = bytes_per_request(HTTPRequest, files)
+    print "Requests: {}".format(n)
+    print "Before: {:.0f} bytes/request".format(before)
+    print "After:  {:.0f} bytes/request".format(after)
+    print "Saving: {:.0f}%".format(100 * (1 - after / before))
@@ -0,0 +1,83 @@
+# Outgoing information of the GET fingerprints, exact and bounded by the detection threshold.
+#
+# Compares the previous computation (an edit distance for the URI and every
+# header value of each pair of consecutive requests) with
+# FingerprintGenerator(outgoing_bound), on the clusters (host, user-agent,
+# 10 minutes window) of the logs in test-data/user/log and test-data/malware.
+# Bounded values must be exact up to the bound, and above it for the clusters
+# whose exact value is above it.
+#
+# Usage: python benchmarks/outgoing_info_benchmark.py [log files]
+
+# Add sys.path variable such that we are able to import from parent directory
+import os
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.sys.path.insert(0, parentdir)
+
+import glob
+import timeit
+import editdistance
+from bro_parser import BroParser
+from decanter_new import HTTPRequest
+from detection import DetectionModule
+from fingerprint import FingerprintGenerator
+
+
+class LegacyFingerprintGenerator(FingerprintGenerator):
+    """ Previous implementation, kept here as the reference for the benchmark. """
+
+    def _compute_outgoing_info(self, current_req, old_req, outgoing_info, cache, bound=None):
+        if current_req.method == "POST":
+            outgoing_info += current_req.req_body_len
+            return outgoing_info
+        outgoing_info += editdistance.eval(current_req.uri, old_req.uri)
+        outgoing_info += current_req.req_body_len
+        for header_name in current_req.header_values.keys():
+            if header_name not in old_req.header_values:
+                outgoing_info += len(current_req.header_values[header_name])
+            else:
+                outgoing_info += editdistance.eval(current_req.header_values[header_name], old_req.header_values[header_name])
+        cache.pop()
+        cache.append(current_req)
+        return outgoing_info
+
+
+def clusters(files):
+    result = {}
+    for row in BroParser('mmap').iterFile(files):
+        h = HTTPRequest(row)
+        if h.method == 'GET':
+            window = h.ts.replace(minute=h.ts.minute - h.ts.minute % 10, second=0, microsecond=0)
+            result.setdefault((h.orig_ip, h.header_values.get('user-agent', 'None'), window), []).append(h)
+    return result.values()
+
+
+def outgoing_info(generator, clusters):
+    return [generator.generate_fingerprint(c, 'GET', 'Background').outgoing_info for c in clusters]
+
+
+def clusters_per_second(generator, clusters, repeat=3):
+    timer = timeit.Timer(lambda: outgoing_info(generator, clusters))
+    return len(clusters) / min(timer.repeat(repeat=repeat, number=1))
+
+
+if __name__ == '__main__':
+    files = os.sys.argv[1:] or (sorted(glob.glob(os.path.join(parentdir, 'test-data', 'user', 'log', '*.log'))) +
+                                sorted(glob.glob(os.path.join(parentdir, 'test-data', 'malware', '*', '*.log'))))
+    clusters = clusters(files)
+    bound = DetectionModule().outgoing_threshold
+
+    # Exact values must not change, bounded ones must be exact up to the bound.
+    exact = outgoing_info(LegacyFingerprintGenerator(), clusters)
+    assert outgoing_info(FingerprintGenerator(), clusters) == exact
+    for e, b in zip(exact, outgoing_info(FingerprintGenerator(bound), clusters)):
+        assert e == b if e <= bound else bound < b <= e, (e, b)
+
+    before = clusters_per_second(LegacyFingerprintGenerator(), clusters)
+    after_exact = clusters_per_second(FingerprintGenerator(), clusters)
+    after = clusters_per_second(FingerprintGenerator(bound), clusters)
+    print "Clusters: {} ({} requests, {} above {})".format(len(clusters), sum(len(c) for c in clusters),
+                                                           sum(e > bound for e in exact), bound)
+    print "Before: {:.0f} clusters/sec".format(before)
+    print "After:  {:.0f} clusters/sec ({:.0f} exact)".format(after, after_exact)
+    print "Speedup: {:.2f}x".format(after / before)
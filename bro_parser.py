@@ -1,12 +1,43 @@
 from __future__ import division
 from brothon import bro_log_reader
 import pandas as pd
+from header_decoder import parse_header_values
+from bro_reader import MappedBroLog, JsonBroLog, DECANTER_FIELDS, detect_format, expand_logs, is_compressed, merge_rows
+from log_cache import ParsedLogCache
+from log_follower import LogFollower
+from collections import deque
+from itertools import islice
+from operator import itemgetter
+import multiprocessing
 
 class BroParser:
     """ Parse Bro log files """ 
     
-    def __init__(self):
-        pass
+    # Available readers of Bro ASCII logs.
+    readers = ('brothon', 'mmap')
+    
+    def __init__(self, reader='brothon', cache_dir=None):
+        """ Parameters
+            ----------
+            reader : string, default = 'brothon'
+                'brothon' reads every column with brothon's BroLogReader.
+                'mmap' memory-maps the log and decodes only the columns used by
+                DECANTeR (see bro_reader.DECANTER_FIELDS).
+                
+            cache_dir : string, default = None
+                Folder of the parsed-log cache (see log_cache.ParsedLogCache).
+                Logs that were already parsed are loaded from the cache instead
+                of being parsed again. No cache is used when None.
+            """
+        if reader not in self.readers:
+            raise ValueError('The reader {} is not valid. Choose between {}.'.format(reader, ', '.join(self.readers)))
+        self.reader = reader
+        self.cache_dir = cache_dir
+        self.cache = ParsedLogCache(cache_dir) if cache_dir is not None else None
+        # Rows read by the 'mmap' reader depend on the columns it decodes.
+        self.variant = reader if reader != 'mmap' else '{}:{}'.format(reader, ','.join(DECANTER_FIELDS))
+        # LogFollower of the log followed with followFile, e.g. to save its position.
+        self.follower = None
     
     def parseFile(self, filename):
         """ Creates a pandas dataframe from given brofile
@@ -21,28 +52,185 @@ class BroParser:
             result : pd.DataFrame
                 Pandas dataframe containing bro log file
             """
-        bro_log = bro_log_reader.BroLogReader(filename)
-        data = pd.DataFrame(bro_log.readrows())
-        data['header_values'] = data['header_values'].apply(self.__parseHeaderValues__)
-        return data
+        return pd.DataFrame(list(self.iterFile(filename)))
     
-    def __parseHeaderValues__(self, headerValues):
-        """ Parse header values from BRO encoding to dictionary.
-        
+    def parseFiles(self, filename, workers=1):
+        """ Creates a pandas dataframe for each given brofile, parsing them in parallel
+            
             Parameters
             ----------
-            headerValues : string
-                header value in bro format
+            filename : string, or list of string
+                Paths, directories or glob patterns of the files to be parsed
+                (see bro_reader.expand_logs).
+                
+            workers : int, default = 1
+                Number of worker processes. Files are parsed in the current
+                process when 1.
                 
             Returns
             -------
-            result : dict
-                header value in dict format
+            result : list of (string, pd.DataFrame)
+                Path and pandas dataframe of every bro log file, in the order
+                of the files.
+            """
+        return [(name, pd.DataFrame(rows)) for name, rows in self.iterFiles(filename, workers)]
+    
+    def iterFiles(self, filename, workers=1):
+        """ Lazily iterate over the parsed rows of each given brofile
             
-            """       
+            Every file is parsed as a whole by one of the worker processes, and
+            the results are yielded in the order of the files as soon as they
+            are available.
+            
+            Parameters
+            ----------
+            filename : string, or list of string
+                Paths, directories or glob patterns of the files to be parsed.
+                
+            workers : int, default = 1
+                Number of worker processes. Files are parsed in the current
+                process when 1.
+                
+            Returns
+            -------
+            result : generator of (string, list of dict)
+                Path and rows of every bro log file.
+            """
+        filenames = expand_logs(filename)
+        if workers <= 1 or len(filenames) <= 1:
+            for name in filenames:
+                yield name, list(self.iterFile(name))
+            return
+        
+        workers = min(workers, len(filenames))
+        tasks = ((self.reader, self.cache_dir, name) for name in filenames)
+        pool = multiprocessing.Pool(workers)
         try:
-		    return dict((x, y) for x, y in list(map( lambda entry:(entry.split('||')[0].lower(), entry.split('||')[1].replace('\\x2c', ',')),headerValues.split(','))))
-        except:
-		    return {}
+            # At most two files per worker are parsed ahead of the consumer, so
+            # that the parsed rows waiting in memory stay bounded.
+            pending = deque(pool.apply_async(_parse_file, (task,)) for task in islice(tasks, 2 * workers))
+            while pending:
+                result = pending.popleft().get()
+                for task in islice(tasks, 1):
+                    pending.append(pool.apply_async(_parse_file, (task,)))
+                yield result
+        finally:
+            # Let the files in progress finish, terminate() can deadlock while
+            # workers are sending their results.
+            pool.close()
+            pool.join()
+    
+    def mergeFiles(self, filename, workers=1):
+        """ Iterate over the rows of the given brofiles ordered by time
+            
+            Files are parsed as in iterFiles() and their rows are merged by
+            timestamp, e.g. to analyze the logs of several hosts or samples as
+            a single trace.
+            
+            Parameters
+            ----------
+            filename : string, or list of string
+                Paths, directories or glob patterns of the files to be parsed.
+                
+            workers : int, default = 1
+                Number of worker processes.
+                
+            Returns
+            -------
+            result : generator of dict
+                Rows of all the files, ordered by their 'ts' column.
+            """
+        # Bro writes a row when the request is complete, so the rows of a log
+        # are only roughly ordered: each file is sorted (stably) before merging.
+        return merge_rows([sorted(rows, key=itemgetter('ts')) for _, rows in self.iterFiles(filename, workers)])
+    
+    def iterFile(self, filename):
+        """ Lazily iterate over the rows of given brofile
+            
+            Rows are read, parsed and yielded one at a time, so memory usage does
+            not grow with the size of the log and the Aggregator can start
+            processing requests before the whole file has been read.
+            
+            Parameters
+            ----------
+            filename : string, or list of string
+                Path to file to be parsed, or glob pattern (e.g., of the logs
+                rotated by Bro). Matching files are read one after the other
+                in name order (see bro_reader.expand_logs).
+                
+            Returns
+            -------
+            result : generator of dict
+                One dictionary per bro log row, with decoded header values
+                
+            Both ASCII and JSON (LogAscii::use_json=T) logs are supported, plain
+            or compressed with gzip, bzip2 or xz.
+            """
+        for name in expand_logs(filename):
+            if self.cache is not None:
+                rows = self.cache.rows(name, lambda: self._readrows(name), variant=self.variant)
+            else:
+                rows = self._parserows(name)
+            for row in rows:
+                yield row
+    
+    def followFile(self, filename, poll_interval=1.0, from_start=False, position=None):
+        """ Follow given brofile while Bro is writing it (see log_follower.LogFollower)
+            
+            Parameters
+            ----------
+            filename : string
+                Path to the log written by Bro (e.g., decanter.log).
+                
+            poll_interval : float, default = 1.0
+                Seconds between two checks for new rows.
+                
+            from_start : boolean, default = False
+                Also read the rows already in the log.
+                
+            position : (int, int), default = None
+                Continue after the position of a previous follower (see
+                LogFollower), instead of the end of the log.
+                
+            Returns
+            -------
+            result : generator of dict, or None
+                One dictionary per new bro log row, with decoded header values,
+                and None while no row is written. The generator never ends,
+                unless the follower is stopped.
+            """
+        follower = self.follower = LogFollower(filename, DECANTER_FIELDS if self.reader == 'mmap' else None,
+                                               poll_interval, from_start, position=position)
+        for row in follower.readrows():
+            if row is not None:
+                row['header_values'] = parse_header_values(row['header_values'])
+            yield row
+    
+    def _parserows(self, filename):
+        """ Parse the rows of given brofile, decoding their header values """
+        for row in self._readrows(filename):
+            row['header_values'] = parse_header_values(row['header_values'])
+            yield row
+    
+    def _readrows(self, filename):
+        """ Iterate over the raw rows of given brofile with the configured reader
+            
+            JSON logs are detected from their first line and always read with
+            bro_reader.JsonBroLog. With the 'mmap' reader only the columns used
+            by DECANTeR are decoded. Compressed ASCII logs are always read with
+            bro_reader.MappedBroLog, which decompresses them in the background
+            (brothon only reads plain files).
+            """
+        if detect_format(filename) == 'json':
+            return JsonBroLog(filename, DECANTER_FIELDS if self.reader == 'mmap' else None).readrows()
+        if self.reader == 'mmap':
+            return MappedBroLog(filename).readrows()
+        if is_compressed(filename):
+            return MappedBroLog(filename, fields=None).readrows()
+        return bro_log_reader.BroLogReader(filename).readrows()
 
 
+def _parse_file(args):
+    """ Parse a brofile in a worker process of BroParser.iterFiles """
+    reader, cache_dir, filename = args
+    return filename, list(BroParser(reader, cache_dir).iterFile(filename))
@@ -0,0 +1,644 @@
+from __future__ import division
+import bz2
+import calendar
+import datetime
+import glob
+import gzip
+import heapq
+import mmap
+import os
+import Queue
+import sys
+import threading
+from collections import deque
+try:
+    import ujson as json
+except ImportError:
+    import json
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# Columns written by decanter_dump_input.bro with decanter_precompute=T. They are
+# used instead of computing the same values in Python when they are in the log.
+PRECOMPUTED_FIELDS = ('header_bytes', 'host_domain', 'referer_domain', 'uri_path', 'uri_query')
+
+# Columns of decanter.log read by the DECANTeR pipeline. The is_malicious column
+# is only present in labelled logs and it is used by the evaluation, uid is used
+# to recognize the requests seen by several sensors.
+DECANTER_FIELDS = ('ts', 'uid', 'id.orig_h', 'id.resp_h', 'method', 'uri', 'request_body_len',
+                   'header_values', 'version', 'is_malicious') + PRECOMPUTED_FIELDS
+
+# Columns identifying a request when the logs of several sensors are merged.
+# Bro gives one uid to all the requests of a connection, so uid alone is not enough.
+DEDUP_KEY = ('uid', 'method', 'uri')
+
+
+# Bro types of the columns written by decanter_dump_input.bro. JSON logs carry no
+# #types header, so these are used to convert and default their values.
+FIELD_TYPES = {
+    'ts':               'time',
+    'uid':              'string',
+    'id.orig_h':        'addr',
+    'id.orig_p':        'port',
+    'id.resp_h':        'addr',
+    'id.resp_p':        'port',
+    'mac_orig':         'string',
+    'method':           'string',
+    'uri':              'string',
+    'version':          'string',
+    'request_body_len': 'count',
+    'proxied':          'set[string]',
+    'orig_mime_types':  'vector[string]',
+    'header_values':    'set[string]',
+    'header_bytes':     'count',
+    'host_domain':      'string',
+    'referer_domain':   'string',
+    'uri_path':         'string',
+    'uri_query':        'string',
+}
+
+
+# Columns of JSON logs that are not joined into strings, header_decoder decodes
+# them directly from the list of NAME||value elements.
+LIST_FIELDS = ('header_values',)
+
+
+# Conversion of Bro types, consistent with brothon.bro_log_reader so that rows
+# can be used interchangeably. Types not listed here are kept as strings.
+TYPE_CONVERTERS = {
+    'bool':     lambda x: x == 'T',
+    'count':    int,
+    'int':      int,
+    'port':     int,
+    'double':   float,
+    'time':     lambda x: datetime.datetime.fromtimestamp(float(x)),
+    'interval': lambda x: datetime.timedelta(seconds=float(x)),
+}
+
+# Value of unset ('-') fields per Bro type. Types not listed here keep the '-'.
+UNSET_VALUES = {
+    'bool':     False,
+    'count':    0,
+    'int':      0,
+    'port':     0,
+    'double':   0.0,
+    'time':     datetime.datetime.fromtimestamp(86400),
+    'interval': datetime.timedelta(seconds=0),
+}
+
+
+# Extensions of the compressed logs written by Bro's log rotation (or by hand).
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.xz')
+
+
+class MappedBroLog:
+    """ Memory-mapped reader of Bro ASCII log files.
+
+        The log is mapped in memory and the #fields/#types header is parsed once.
+        For every row only the requested columns are sliced out of the line and
+        converted: the columns after the last requested one are never split, and
+        the ones in between are dropped without any conversion.
+
+        Compressed logs cannot be mapped, their lines are read from a
+        BackgroundDecompressor instead.
+    """
+
+    def __init__(self, filename, fields=DECANTER_FIELDS):
+        """ Create a reader for the given Bro log file
+
+            Parameters
+            ----------
+            filename : string
+                Path to the Bro log file.
+
+            fields : iterable of string, default = DECANTER_FIELDS
+                Columns to decode. Columns that are not in the log are ignored.
+                Use None to decode all the columns.
+
+            """
+        self.filename = filename
+        self.fields = fields
+        self.separator = '\t'
+        self.set_separator = ','
+        self.empty_field = '(empty)'
+        self.unset_field = '-'
+        self.field_names = []
+        self.field_types = []
+
+    def readrows(self):
+        """ Iterate over the rows of the log
+
+            Returns
+            -------
+            result : generator of dict
+                One dictionary per row, containing the requested columns.
+
+            """
+        if is_compressed(self.filename):
+            for row in self._readrows(iter(BackgroundDecompressor(self.filename))):
+                yield row
+            return
+        with open(self.filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for row in self._readrows(iter(buf.readline, '')):
+                    yield row
+            finally:
+                buf.close()
+
+    def _readrows(self, lines):
+        # Parse the header once, it ends with the #types line.
+        line = next(lines, '')
+        while line.startswith('#'):
+            self._parse_header_line(line.rstrip('\n'))
+            if line.startswith('#types'):
+                break
+            line = next(lines, '')
+        else:
+            # Headerless file, the first line is data but we cannot interpret it.
+            if line:
+                raise ValueError('{} is not a Bro log file: the #fields/#types header is missing.'.format(self.filename))
+
+        columns = self._columns()
+        if not columns:
+            return
+        separator = self.separator
+        unset_field = self.unset_field
+        # Number of values to split out of each line.
+        needed = max(index for _, index, _, _ in columns) + 1
+
+        for line in lines:
+            if not line or line[0] == '#':
+                if line.startswith('#close'):
+                    return
+                continue
+            values = line.rstrip('\n').split(separator, needed)
+            if len(values) < needed:
+                continue
+            row = {}
+            for name, index, converter, unset in columns:
+                value = values[index]
+                if value == unset_field:
+                    row[name] = unset
+                elif converter is None:
+                    row[name] = value
+                else:
+                    row[name] = converter(value)
+            yield row
+
+    def _columns(self):
+        """ Return (name, index, converter, unset value) for each column to decode. """
+        columns = []
+        for index, (name, field_type) in enumerate(zip(self.field_names, self.field_types)):
+            if self.fields is not None and name not in self.fields:
+                continue
+            columns.append((name, index, TYPE_CONVERTERS.get(field_type, None), UNSET_VALUES.get(field_type, self.unset_field)))
+        return columns
+
+    def _parse_header_line(self, line):
+        if line.startswith('#separator'):
+            self.separator = line.split(' ', 1)[1].decode('string_escape')
+            return
+        key, _, value = line.partition(self.separator)
+        if key == '#set_separator':
+            self.set_separator = value
+        elif key == '#empty_field':
+            self.empty_field = value
+        elif key == '#unset_field':
+            self.unset_field = value
+        elif key == '#fields':
+            self.field_names = value.split(self.separator)
+        elif key == '#types':
+            self.field_types = value.split(self.separator)
+
+
+class JsonBroLog:
+    """ Reader of Bro log files written with LogAscii::use_json=T.
+
+        Each line is decoded with ujson when it is installed (json otherwise).
+        Values are converted to the same types produced for ASCII logs, except
+        for header_values which is kept as the list of NAME||value elements
+        (unicode), so that it does not go through the ASCII set encoding.
+    """
+
+    def __init__(self, filename, fields=DECANTER_FIELDS):
+        """ Create a reader for the given Bro JSON log file
+
+            Parameters
+            ----------
+            filename : string
+                Path to the Bro log file.
+
+            fields : iterable of string, default = DECANTER_FIELDS
+                Columns to decode. Use None to decode all the columns.
+
+            """
+        self.filename = filename
+        self.fields = fields
+
+    def readrows(self):
+        """ Iterate over the rows of the log
+
+            Returns
+            -------
+            result : generator of dict
+                One dictionary per row, containing the requested columns.
+                Columns of decanter.log that are unset in a row get the same
+                value as unset columns of ASCII logs.
+
+            """
+        if is_compressed(self.filename):
+            for row in self._readrows(BackgroundDecompressor(self.filename)):
+                yield row
+            return
+        with open(self.filename, 'rb') as f:
+            for row in self._readrows(f):
+                yield row
+
+    def _readrows(self, lines):
+        loads = json.loads
+        convert = self._converter()
+        for line in lines:
+            if line.strip():
+                yield convert(loads(line))
+
+    def _converter(self):
+        """ Return the function converting a decoded JSON record into a row. """
+        if self.fields is None:
+            return self._convert_all
+
+        # Converter and unset value of each requested column.
+        columns = [(name, _json_converter(name, FIELD_TYPES.get(name)), FIELD_TYPES.get(name)) for name in self.fields]
+        # Precomputed columns missing from a record are not in the log at all.
+        columns = [(name, converter, _unset_value(field_type) if field_type and name not in PRECOMPUTED_FIELDS else _MISSING)
+                   for name, converter, field_type in columns]
+
+        def convert(record):
+            row = {}
+            for name, converter, unset in columns:
+                value = record.get(name)
+                if value is None:
+                    if unset is not _MISSING:
+                        row[name] = unset
+                elif converter is None:
+                    row[name] = value
+                else:
+                    row[name] = converter(value)
+            return row
+        return convert
+
+    def _convert_all(self, record):
+        row = dict((name, _unset_value(field_type)) for name, field_type in FIELD_TYPES.iteritems()
+                   if name not in PRECOMPUTED_FIELDS)
+        for name, value in record.iteritems():
+            name = str(name)
+            if value is not None:
+                converter = _json_converter(name, FIELD_TYPES.get(name))
+                row[name] = value if converter is None else converter(value)
+        return row
+
+
+def detect_format(filename):
+    """ Detect whether a Bro log file is written in ASCII or JSON format
+
+        Parameters
+        ----------
+        filename : string
+            Path to the Bro log file.
+
+        Returns
+        -------
+        result : string
+            'json' if the first line of the log is a JSON object, 'ascii' otherwise.
+
+        """
+    with open_log(filename) as f:
+        return _detect_format(f.readline())
+
+
+def _detect_format(first_line):
+    return 'json' if first_line.lstrip().startswith('{') else 'ascii'
+
+
+def is_compressed(filename):
+    """ Return True if the log is compressed, according to its extension. """
+    return filename.endswith(COMPRESSED_EXTENSIONS)
+
+
+def open_log(filename):
+    """ Open a Bro log file for reading, decompressing it if needed
+
+        Parameters
+        ----------
+        filename : string
+            Path to the Bro log file, optionally ending with .gz, .bz2 or .xz.
+
+        Returns
+        -------
+        result : file object
+
+        """
+    if filename.endswith('.gz'):
+        return gzip.GzipFile(filename, 'rb')
+    if filename.endswith('.bz2'):
+        return bz2.BZ2File(filename, 'rb')
+    if filename.endswith('.xz'):
+        if lzma is None:
+            raise ImportError('Reading {} requires the lzma module (pip install backports.lzma).'.format(filename))
+        return lzma.LZMAFile(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def expand_logs(patterns):
+    """ Expand paths, directories and glob patterns of Bro log files
+
+        Every pattern is expanded separately and its matches are sorted by name,
+        which is the chronological order of the files rotated by Bro (e.g.,
+        decanter.2018-01-16-10-00-00.log.gz, decanter.2018-01-16-11-00-00.log.gz).
+        A directory stands for all the files it contains.
+
+        Parameters
+        ----------
+        patterns : string, or list of string
+            Paths, directories or glob patterns.
+
+        Returns
+        -------
+        result : list of string
+            Paths of the log files, in the order they are meant to be read.
+
+        """
+    if isinstance(patterns, basestring):
+        patterns = [patterns]
+    filenames = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*')
+        matches = sorted(f for f in glob.glob(pattern) if not os.path.isdir(f))
+        if not matches:
+            if glob.has_magic(pattern):
+                raise IOError('No Bro log file matches {}.'.format(pattern))
+            # Let the reader report the missing file.
+            matches = [pattern]
+        filenames.extend(matches)
+    return filenames
+
+
+def merge_rows(streams, key='ts'):
+    """ Merge streams of rows, each ordered by time, into one ordered stream
+
+        Parameters
+        ----------
+        streams : list of iterable of dict
+            Rows of every log, in the order of the log.
+
+        key : string, default = 'ts'
+            Column the rows are ordered by.
+
+        Returns
+        -------
+        result : generator of dict
+            Rows of all the streams ordered by key. Rows with the same key are
+            yielded in the order of the streams.
+
+        """
+    decorated = [_decorate(stream, i, key) for i, stream in enumerate(streams)]
+    for _, _, row in heapq.merge(*decorated):
+        yield row
+
+
+class SensorMerger:
+    """ Merge the logs of several sensors into one stream ordered by time.
+
+        The streams are merged lazily with a heap, which holds one row per
+        stream. A request logged by more than one sensor (same DEDUP_KEY
+        columns, from a different stream, within window seconds) is only
+        yielded once. The keys seen in the last window seconds are the only
+        other state, so memory does not grow with the length of the logs.
+
+        The merge assumes that every stream is ordered by time. Bro logs a
+        request when it is complete, so rows can be slightly out of order:
+        with slack > 0, every stream is first reordered within slack seconds.
+    """
+
+    def __init__(self, streams, dedup_key=DEDUP_KEY, window=60, slack=0):
+        """ Parameters
+            ----------
+            streams : list of iterable of dict
+                Parsed rows of every sensor (e.g., BroParser.iterFile()).
+
+            dedup_key : tuple of string, default = DEDUP_KEY
+                Columns identifying a request. Independent Bro instances give
+                different uids to the same connection, in that case use columns
+                like ('id.orig_h', 'id.resp_h', 'method', 'uri'). Use None to
+                disable de-duplication.
+
+            window : int, default = 60
+                Maximum time difference, in seconds, between the copies of a
+                request logged by different sensors.
+
+            slack : int, default = 0
+                Maximum delay, in seconds, of a row with respect to the rows
+                that precede it in its stream.
+
+            """
+        self.streams = streams
+        self.dedup_key = dedup_key
+        self.window = datetime.timedelta(seconds=window)
+        self.slack = datetime.timedelta(seconds=slack)
+        self.duplicates = 0
+
+    def __iter__(self):
+        streams = self.streams
+        if self.slack:
+            streams = [reorder_rows(stream, self.slack) for stream in streams]
+        merged = heapq.merge(*[_decorate(stream, i) for i, stream in enumerate(streams)])
+
+        if self.dedup_key is None:
+            for _, _, row in merged:
+                yield row
+            return
+
+        dedup_key = self.dedup_key
+        window = self.window
+        # key -> (stream, ts) of its last occurrence, and the keys in order of time.
+        seen = {}
+        recent = deque()
+        for ts, i, row in merged:
+            while recent and ts - recent[0][0] > window:
+                old_ts, old_key = recent.popleft()
+                last = seen.get(old_key)
+                if last is not None and last[1] == old_ts:
+                    del seen[old_key]
+            key = tuple(row.get(c) for c in dedup_key)
+            last = seen.get(key)
+            if last is not None and last[0] != i:
+                # Same request from another sensor.
+                self.duplicates += 1
+                continue
+            seen[key] = (i, ts)
+            recent.append((ts, key))
+            yield row
+
+
+def _decorate(rows, index, key='ts'):
+    """ Turn the rows of a stream into (key, stream index, row) tuples for heapq.merge. """
+    for row in rows:
+        yield row[key], index, row
+
+
+def reorder_rows(rows, slack, key='ts'):
+    """ Sort a stream of rows that is ordered by time up to a given delay
+
+        Parameters
+        ----------
+        rows : iterable of dict
+
+        slack : datetime.timedelta
+            Maximum delay of a row with respect to the rows preceding it.
+
+        key : string, default = 'ts'
+            Column the rows are ordered by.
+
+        Returns
+        -------
+        result : generator of dict
+            The rows ordered by key, rows with the same key in their original
+            order. Only the rows of the last slack seconds are held in memory.
+
+        """
+    heap = []
+    for n, row in enumerate(rows):
+        ts = row[key]
+        heapq.heappush(heap, (ts, n, row))
+        while ts - heap[0][0] > slack:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+class BackgroundDecompressor:
+    """ Iterate over the lines of a compressed log, decompressing it in a thread.
+
+        Blocks of lines are decompressed and split by a background thread and
+        handed to the reader through a bounded queue, so that decompression
+        (which releases the GIL in zlib, bz2 and lzma) overlaps with parsing
+        while at most max_blocks blocks are held in memory. Lines are yielded
+        without the trailing newline.
+    """
+
+    def __init__(self, filename, block_size=1 << 20, max_blocks=8):
+        """ Parameters
+            ----------
+            filename : string
+                Path to the compressed Bro log file.
+
+            block_size : int, default = 1MB
+                Amount of decompressed data read at once.
+
+            max_blocks : int, default = 8
+                Maximum number of decompressed blocks waiting to be parsed.
+
+            """
+        self.filename = filename
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+
+    def __iter__(self):
+        queue = Queue.Queue(self.max_blocks)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._decompress, args=(queue, stop))
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                block = queue.get()
+                if block is _END:
+                    return
+                if isinstance(block, tuple):
+                    # The thread failed, raise its exception here.
+                    raise block[0], block[1], block[2]
+                for line in block:
+                    yield line
+        finally:
+            # Also stops the thread when the reader does not consume all lines.
+            stop.set()
+            thread.join()
+
+    def _decompress(self, queue, stop):
+        try:
+            with open_log(self.filename) as f:
+                rest = ''
+                while not stop.is_set():
+                    data = f.read(self.block_size)
+                    if not data:
+                        break
+                    lines = (rest + data).split('\n')
+                    rest = lines.pop()
+                    self._put(queue, stop, lines)
+                if rest:
+                    self._put(queue, stop, [rest])
+            self._put(queue, stop, _END)
+        except Exception:
+            self._put(queue, stop, sys.exc_info())
+
+    def _put(self, queue, stop, item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+
+_MISSING = object()
+_END = object()
+
+
+def _json_converter(name, field_type):
+    """ Return the function converting a JSON value of the given column, None if
+        the value is kept as decoded. """
+    if name == 'ts':
+        return _json_time
+    if name in LIST_FIELDS:
+        # Decoded as a whole by header_decoder.
+        return None
+    if field_type is not None and (field_type.startswith('set[') or field_type.startswith('vector[')):
+        return _json_joined
+    if field_type in TYPE_CONVERTERS:
+        # Numbers and booleans are decoded by the JSON parser.
+        return None
+    return _json_value
+
+
+def _json_value(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return _json_joined(value)
+    return value
+
+
+def _json_joined(value):
+    """ Join a JSON container as in ASCII logs. """
+    return ','.join(_json_value(v) if isinstance(v, unicode) else str(v) for v in value) if value else '(empty)'
+
+
+def _unset_value(field_type):
+    return UNSET_VALUES.get(field_type, '-')
+
+
+def _json_time(value):
+    """ Convert a JSON timestamp (epoch or ISO 8601 in UTC) like ASCII logs do. """
+    if isinstance(value, basestring):
+        seconds, _, fraction = str(value).rstrip('Z').partition('.')
+        epoch = calendar.timegm(datetime.datetime.strptime(seconds, '%Y-%m-%dT%H:%M:%S').timetuple())
+        return datetime.datetime.fromtimestamp(epoch) + datetime.timedelta(microseconds=int(fraction.ljust(6, '0')[:6]))
+    return datetime.datetime.fromtimestamp(value)
@@ -1,13 +1,48 @@
 import pandas as pd
+import cPickle as pickle
 import datetime
+import gzip
+import os
+import tempfile
+import time
+import heapq
+import domains
+from urlparse import urlparse
+from collections import OrderedDict
+from itertools import izip
 from label_generation import LabelGenerator
-from fingerprint import Fingerprint, FingerprintGenerator, FingerprintManager 
+from fingerprint import Fingerprint, FingerprintAccumulator, FingerprintGenerator, FingerprintManager 
+from fingerprint_db import FingerprintDatabase
 from detection import DetectionModule
 
-class HTTPRequest():
+# Bump when the state of the Aggregator changes, older checkpoints are then refused.
+CHECKPOINT_VERSION = 7
+
+# Fingerprints created in Training mode are stored this many at once, in one
+# transaction of a FingerprintDatabase.
+TRAINING_BATCH_SIZE = 1000
+
+# Header values that are the same for most requests of an application. They are
+# interned, so that the requests of a window share a single copy of each value.
+INTERNED_HEADERS = ('user-agent', 'host', 'accept', 'accept-language', 'accept-encoding', 'accept-charset',
+                    'connection', 'content-type', 'cache-control', 'pragma', 'dnt', 'x-requested-with',
+                    'upgrade-insecure-requests')
+
+
+class HTTPRequest(object):
     """
     This class represents an HTTP request.
+    
+    Every request of a time window is kept in memory (and the ones of the last
+    window of each user-agent in the referrer graphs), so requests have no
+    per-instance __dict__, and the strings repeated across requests (IP
+    addresses, method, version, user-agent and other common header values)
+    are interned.
     """
+    
+    __slots__ = ('uid', 'ts', 'orig_ip', 'orig_port', 'dest_ip', 'dest_port', 'header_values', 'uri', 'version',
+                 'method', 'orig_mime_type', 'req_body_len', 'is_malicious', 'header_bytes', 'host_domain',
+                 'referer_domain', 'uri_path', 'uri_query', 'shed')
 
     def __init__(self, http_req):
         """
@@ -20,25 +55,89 @@ class HTTPRequest():
         """
         self.uid = http_req.get('uid', None)
         self.ts = http_req.get('ts', None)
-        self.orig_ip = http_req.get('id.orig_h', None)
+        self.orig_ip = _intern(http_req.get('id.orig_h', None))
         self.orig_port = http_req.get('id.orig_p', None)
-        self.dest_ip = http_req.get('id.resp_h', None)
+        self.dest_ip = _intern(http_req.get('id.resp_h', None))
         self.dest_port = http_req.get('id.resp_p', None)
         self.header_values = http_req.get('header_values', None)
         self.uri = http_req.get('uri', None)
-        self.version = http_req.get('version', None)
-        self.method = http_req.get('method', None)
+        self.version = _intern(http_req.get('version', None))
+        self.method = _intern(http_req.get('method', None))
         self.orig_mime_type = http_req.get('orig_mime_types', None)
         self.req_body_len = http_req.get('request_body_len', 0)
         
         # TODO : added for evasion analysis
-        self.is_malicious = http_req.get('is_malicious', None)
+        self.is_malicious = _intern(http_req.get('is_malicious', None))
+        
+        # Columns precomputed by decanter_dump_input.bro (decanter_precompute=T),
+        # None if they are not in the log.
+        self.header_bytes = http_req.get('header_bytes', None)
+        self.host_domain = _intern(_precomputed(http_req.get('host_domain', None)))
+        self.referer_domain = _intern(_precomputed(http_req.get('referer_domain', None)))
+        self.uri_path = _precomputed(http_req.get('uri_path', None))
+        self.uri_query = _precomputed(http_req.get('uri_query', None))
+        
+        # Shed requests (see load_shedding.LoadShedder) are only kept for the referrer graph, they are not fingerprinted.
+        self.shed = False
+        
+        # Otherwise the URI is split once here, instead of every time it is needed.
+        if (self.uri_path is None or self.uri_query is None) and self.uri is not None:
+            parsed_uri = urlparse(self.uri)
+            self.uri_path = parsed_uri.path
+            self.uri_query = parsed_uri.query
+        
+        # Header names are already interned by header_decoder.
+        header_values = self.header_values
+        if isinstance(header_values, dict):
+            for name in INTERNED_HEADERS:
+                value = header_values.get(name)
+                if type(value) is str:
+                    header_values[name] = intern(value)
         
         
     def __str__(self):
         return "Request:\n{} {}\nHeaders:\n{}\n".format(self.method, self.uri, self.header_values.items())
     
 
+def _intern(value):
+    """ Intern a string value, other values are returned as they are. """
+    return intern(value) if type(value) is str else value
+
+
+def _precomputed(value):
+    """ Value of a precomputed string column, None if it is not in the log or it is unset. """
+    if value is None or value == '-':
+        return None
+    if value == '(empty)':
+        return ''
+    return value
+
+
+def _rows(data):
+    """
+        Generate the rows contained in the input data, one dict at a time.
+        
+        Parameter
+        -------------
+        data : pandas Dataframe, or iterable of dict
+    """
+    if isinstance(data, pd.DataFrame):
+        # Walk the columns as lists, instead of creating a Series per row
+        # with iterrows(). Series.tolist() keeps the values as iterrows()
+        # gives them (e.g., ts as Timestamp, counts as int).
+        columns = list(data.columns)
+        for values in izip(*[data[c].tolist() for c in columns]):
+            yield dict(izip(columns, values))
+    else:
+        for row in data:
+            yield row
+
+
+class CheckpointError(Exception):
+    """ Raised when an Aggregator checkpoint cannot be restored. """
+    pass
+
+
 class Aggregator:
     """
     This class is the engine of Decanter. It is responsible of training and testing fingerprints from input data.
@@ -47,16 +146,67 @@ class Aggregator:
     # Timeout used only in testing mode.
     timeout = datetime.timedelta(minutes=10)
     
+    # Available time windows of testing mode.
+    windows = ('global', 'cluster')
+    
 
-    def __init__(self, mode=0, offline=0, dump_testing='testing_fingerprints.csv', dump_training='training_fingerprints.csv'):
+    def __init__(self, mode=0, offline=0, dump_testing='testing_fingerprints.csv', dump_training='training_fingerprints.csv', on_alert=None, window='global', early_fire=False,
+                 max_clusters=None, max_graphs=None, graph_idle=None, fingerprint_db=None, background_dumps=False,
+                 bounded_outgoing=False):
         # 0 for Training mode - 1 for Testing mode
         if (mode != 0 and mode != 1) or (offline != 0 and offline != 1):
             raise ValueError('The mode value is not valid. Choose between 1 or 0.')
+        if window not in self.windows:
+            raise ValueError('The window {} is not valid. Choose between {}.'.format(window, ', '.join(self.windows)))
+        # 'global': one time window for all the clusters, started by the first request after the previous one.
+        # 'cluster': every (host, user-agent) cluster has its own time window, started by its first request.
+        self.window = window
+        # Heap of (deadline, sequence number, host, user-agent) of the clusters, in 'cluster' windows.
+        self.deadlines = []
+        self.sequence = 0
+        # Test the clusters of non-browser applications as soon as their outgoing information exceeds the threshold.
+        self.early_fire = early_fire
+        # (host, user-agent, method) -> [FingerprintAccumulator, outgoing information of the next check]
+        self.early_accumulators = {}
+        # (host, user-agent, method) of the clusters that raised an alert in their current window.
+        self.early_alerts = set()
+        # Memory bounds: when more than max_clusters (host, user-agent) clusters are open, the least recently used
+        # is fingerprinted and flushed. Referrer graphs are dropped when more than max_graphs are kept, least
+        # recently updated first, or when they were not updated for graph_idle (timedelta). None means no bound.
+        self.max_clusters = max_clusters
+        self.max_graphs = max_graphs
+        self.graph_idle = graph_idle
+        # (host, user-agent) of the open clusters, least recently used first (only with max_clusters).
+        self.cluster_lru = OrderedDict()
+        # User-agent -> time of the last update of its referrer graph, least recently updated first.
+        self.graph_updates = OrderedDict()
+        # Number of clusters flushed, and referrer graphs dropped, because of the bounds.
+        self.evicted_clusters = 0
+        self.evicted_graphs = 0
+        # Called with every new alert (Fingerprint) as soon as it is raised.
+        self.on_alert = on_alert
+        # Called with (host, cluster, early_methods) of every closed cluster, instead of creating its fingerprints
+        # in place (see pipeline.Pipeline and _create_fingerprints).
+        self.on_cluster = None
         self.hosts_clusters = {}
         self.label_generator = LabelGenerator()
-        self.fin_generator = FingerprintGenerator()
-        self.fin_manager = FingerprintManager()
+        # Trained fingerprints are kept in memory, or in the SQLite database file fingerprint_db.
+        # In OFFLINE mode, testing fingerprints are dumped in batches, written by a thread with background_dumps.
+        self.fingerprint_db = fingerprint_db
+        # Public suffix list the registered domains are extracted with (see domains.normalizer), by its digest.
+        self.public_suffix_list = domains.normalizer.suffix_digest
+        if fingerprint_db is None:
+            self.fin_manager = FingerprintManager(background=background_dumps)
+        else:
+            self.fin_manager = FingerprintDatabase(fingerprint_db, background=background_dumps)
+        # (host, fingerprint) created in Training mode and not stored yet (see _store_training_batch).
+        self.training_batch = []
         self.detector = DetectionModule()
+        # Only the detection threshold matters for the outgoing information, except for the fingerprints dumped in
+        # OFFLINE mode. With bounded_outgoing it is not computed further once a fingerprint exceeds the threshold.
+        self.bounded_outgoing = bounded_outgoing
+        outgoing_bound = self.detector.outgoing_threshold if bounded_outgoing and offline == 0 else None
+        self.fin_generator = FingerprintGenerator(outgoing_bound)
         self.mode = mode
         self.alerts = []
         self.time_start = None
@@ -70,10 +220,104 @@ class Aggregator:
         # Known browsers
         self.browser_user_agents = set()
         
-        # Referrer graphs per user_agent
-        self.referrerGraphs = dict()
+        # Referrer graphs per user_agent, least recently updated first
+        self.referrerGraphs = OrderedDict()
+        
+        # (filename, position of its LogFollower) of the followed log, saved in the checkpoints.
+        self.log_position = None
 
         
+    def __getstate__(self):
+        # The callbacks belong to the running process, they are set again after a restore.
+        # Alerts were already reported, a restored Aggregator only keeps the new ones.
+        state = self.__dict__.copy()
+        state['on_alert'] = None
+        state['on_cluster'] = None
+        state['alerts'] = []
+        return state
+    
+    
+    def settings(self):
+        """
+            Options the Aggregator was created with, by name (see __init__)
+            
+            public_suffix_list is the digest of the public suffix list loaded
+            in domains.normalizer when it was created, None if there was none.
+            
+            Returns
+            -------------
+            settings : dict
+        """
+        return {'offline': self.offline, 'dump_testing': self.dump_testing, 'dump_training': self.dump_training,
+                'window': self.window, 'early_fire': self.early_fire, 'max_clusters': self.max_clusters,
+                'max_graphs': self.max_graphs, 'graph_idle': self.graph_idle, 'fingerprint_db': self.fingerprint_db,
+                'bounded_outgoing': self.bounded_outgoing, 'public_suffix_list': self.public_suffix_list}
+    
+    
+    def save_checkpoint(self, filename):
+        """
+            Atomically save the whole state of the Aggregator to a file
+            
+            The checkpoint contains the trained fingerprints, the known browser
+            user-agents, the referrer graphs, the open clusters and the clock of
+            the time windows, and the position of the followed log (log_position),
+            so that the analysis can be resumed where it was left with
+            load_checkpoint(). Alerts are not saved. It is a gzip-compressed
+            binary pickle.
+            
+            Parameter
+            -------------
+            filename : string
+        """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=1) as z:
+                    pickle.dump((CHECKPOINT_VERSION, self), z, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, filename)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    
+    
+    @classmethod
+    def load_checkpoint(cls, filename, on_alert=None, **settings):
+        """
+            Restore an Aggregator saved with save_checkpoint()
+            
+            Parameter
+            -------------
+            filename : string
+            
+            on_alert : callable, default = None
+                Called with every new alert, see Aggregator.
+            
+            settings : keyword arguments
+                Options of __init__ (see settings()) expected for the restored
+                Aggregator. They cannot be changed on a trained state, the
+                checkpoint is refused if it was saved with other values. The
+                public suffix list is always checked against the one loaded
+                in domains.normalizer.
+            
+            Returns
+            -------------
+            aggregator : Aggregator
+        """
+        with gzip.open(filename, 'rb') as f:
+            version, aggregator = pickle.load(f)
+        if version != CHECKPOINT_VERSION or not isinstance(aggregator, cls):
+            raise CheckpointError('{} is not a checkpoint of this version of DECANTeR.'.format(filename))
+        settings.setdefault('public_suffix_list', domains.normalizer.suffix_digest)
+        saved = aggregator.settings()
+        different = sorted(name for name, value in settings.iteritems() if saved[name] != value)
+        if different:
+            raise CheckpointError('{} was saved with other options: {}.'.format(
+                filename, ', '.join('{}={!r}'.format(name, saved[name]) for name in different)))
+        aggregator.on_alert = on_alert
+        return aggregator
+    
+    
     def change_mode(self, mode):
         if mode != 0 and mode != 1:
             raise ValueError('The mode value is not valid')
@@ -86,11 +330,13 @@ class Aggregator:
     
     def analyze_log(self, data):
         """
-            Load and aggregate the HTTP requests from a Dataframe
+            Load and aggregate the HTTP requests from a Dataframe or a stream of rows
             
             Parameter
             -------------
-            data : pandas Dataframe
+            data : pandas Dataframe, or iterable of dict
+                A parsed log (see BroParser.parseFile) or a row generator
+                (see BroParser.iterFile), which is consumed lazily.
         """        
         if (self.mode == 0):
             self._training(data)
@@ -100,69 +346,206 @@ class Aggregator:
             pass
         
         
-    def _testing(self, data):
-        
-        for row in data.iterrows():
+    def _http_requests(self, data):
+        """
+            Generate the HTTP requests contained in the input data, one at a time.
             
-            # Generate HTTP request
-            http_data = row[1].to_dict()
-            h = HTTPRequest(http_data)
+            Parameter
+            -------------
+            data : pandas Dataframe, or iterable of dict
             
-            # Initialize Time
-            if self.time_start == None:
-                self.time_start = h.ts
+            Returns
+            -------------
+            result : generator of HTTPRequest
+        """
+        for row in _rows(data):
+            yield HTTPRequest(row)
+    
+    
+    def follow(self, data):
+        """
+            Analyze an unbounded stream of rows (e.g., BroParser.followFile) in Testing mode
             
-            # Aggregate request
-            self._insert_http_request(h)
-
-            # Set current time to the current HTTP request timestamp
-            self.time_current = h.ts
+            Requests are aggregated as they arrive, and the fingerprints of a
+            time window are tested (and alerts raised, see on_alert) as soon as
+            the window is closed. The stream yields None while no request is
+            logged: the time of the log is then advanced with the wall clock, so
+            that the last window is closed even if no request follows it.
             
-            # Check if the timeout is expired
-            if (self.time_current - self.time_start) > self.timeout:
-
-                # Create and store the fingerprints
-                for host in self.hosts_clusters.keys():
-                    for app, http_cluster in self.hosts_clusters[host].iteritems():
-                        self._create_fingerprints(host, http_cluster)
-                
-                # Flush the aggregated HTTP requests and reset the starting time
-                self.hosts_clusters.clear()
-                self.time_start = None
+            Parameter
+            -------------
+            data : iterable of dict, or None
+        """
+        if self.mode != 1:
+            raise ValueError('Following a log is only possible in Testing mode.')
+        last_ts = None
+        for row in data:
+            if row is not None:
+                h = HTTPRequest(row)
+                self._test_request(h)
+                last_ts, last_seen = h.ts, time.time()
+            elif last_ts is not None and self.time_start is not None:
+                self.advance_time(last_ts + datetime.timedelta(seconds=time.time() - last_seen))
+        
+        
+    def _testing(self, data):
+        
+        for h in self._http_requests(data):
+            self._test_request(h)
                 
         # Writing of fingerprints in case the file "ended" and the timeout did not exceed.
-        if self.hosts_clusters:
-            for host in self.hosts_clusters.keys():
-                for app, http_cluster in self.hosts_clusters[host].iteritems():
-                    self._create_fingerprints(host, http_cluster)
-                    
+        self.flush()
+        self.close_dumps()
+    
+    
+    def _test_request(self, h):
+        """
+            Aggregate an HTTP request in Testing mode, closing the time window if the timeout is expired.
+            
+            Parameter
+            -------------
+            h : HTTPRequest
+        """
+        # Initialize Time
+        if self.time_start == None:
+            self.time_start = h.ts
+        
+        # Aggregate request
+        self._insert_http_request(h)
+        if self.early_fire:
+            self._early_check(h)
+        
+        # Set current time to the current HTTP request timestamp
+        self.advance_time(h.ts)
+    
+    
+    def advance_time(self, ts):
+        """
+            Set the current time, closing the time window if the timeout is expired.
+            
+            Parameter
+            -------------
+            ts : datetime
+        """
+        self.time_current = ts
+        
+        # Check if the timeout is expired
+        if self.window == 'cluster':
+            self._expire_clusters()
+        elif self.time_start is not None and (self.time_current - self.time_start) > self.timeout:
+            self.flush()
+    
+    
+    def _expire_clusters(self):
+        """
+            Create and test the fingerprints of the clusters whose own time window is expired.
+            
+            The time start is then the one of the oldest window still open.
+        """
+        deadlines = self.deadlines
+        while deadlines and self.time_current > deadlines[0][0]:
+            deadline, _, host, user_agent = heapq.heappop(deadlines)
+            # The cluster may have been evicted (and created again) since the deadline was set.
+            cluster = self.hosts_clusters.get(host, {}).get(user_agent)
+            if cluster is not None and cluster[0].ts + self.timeout == deadline:
+                self._flush_cluster(host, user_agent)
+        self.time_start = deadlines[0][0] - self.timeout if deadlines else None
+    
+    
+    def _flush_cluster(self, host, user_agent):
+        """
+            Create (and in Testing mode, test) the fingerprints of a single cluster, and remove it.
+        """
+        clusters = self.hosts_clusters[host]
+        self._close_cluster(host, clusters.pop(user_agent))
+        self._forget_early(host, user_agent)
+        self.cluster_lru.pop((host, user_agent), None)
+        if not clusters:
+            del self.hosts_clusters[host]
+    
+    
+    def flush(self):
+        """
+            Create (and in Testing mode, test) the fingerprints of the aggregated HTTP requests, then reset the time window.
+        """
+        # Create and store the fingerprints
+        for host in self.hosts_clusters.keys():
+            for app, http_cluster in self.hosts_clusters[host].iteritems():
+                self._close_cluster(host, http_cluster)
+        
+        # Flush the aggregated HTTP requests and reset the starting time
         self.hosts_clusters.clear()
+        self.cluster_lru.clear()
+        del self.deadlines[:]
+        self.early_accumulators.clear()
+        self.early_alerts.clear()
         self.time_start = None
+        
+        # Write the fingerprints of the window to the dump file. With on_cluster, they are created later by
+        # another thread (see pipeline.Pipeline), and written when enough of them are waiting.
+        if self.on_cluster is None:
+            self.fin_manager.flush_files()
+    
+    
+    def close_dumps(self):
+        """
+            Write the testing fingerprints waiting to be dumped (in OFFLINE mode), and close their file.
+        """
+        self.fin_manager.close_files()
     
         
     def _training(self, data):
         
-        for row in data.iterrows():
-            
-            # Generate HTTP request
-            http_data = row[1].to_dict()
-            h = HTTPRequest(http_data)
+        for h in self._http_requests(data):
             
             # Aggregate request
             self._insert_http_request(h)
-
+        
+        self._finish_training()
+        self._dump_training()
+    
+    
+    def _finish_training(self):
+        """
+            Create and store the fingerprints of all the aggregated HTTP requests, at the end of the training data.
+        """
         # Create and store the fingerprints
         for host in self.hosts_clusters.keys():
             for app, http_cluster in self.hosts_clusters[host].iteritems():
-                self._create_fingerprints(host, http_cluster)
+                self._close_cluster(host, http_cluster)
+        
+        self.hosts_clusters.clear()
+        self.cluster_lru.clear()
+    
+    
+    def _store_training_batch(self):
+        """ Store the fingerprints created in Training mode and not stored yet, at once. """
+        self.fin_manager.store_many(self.training_batch)
+        self.training_batch = []
+    
+    
+    def _dump_training(self):
+        self._store_training_batch()
         
         # In OFFLINE mode , dump the generated fingerprints in a .csv file.
         if self.offline == 1:
             self.fin_manager.write_to_file(self.dump_training)
+    
+    
+    def _close_cluster(self, host, http_cluster):
+        # Methods of the cluster that already raised an alert while its window was open.
+        early_methods = ()
+        if self.early_alerts:
+            user_agent = http_cluster[0].header_values.get('user-agent', 'None')
+            early_methods = [m for m in ('GET', 'POST') if (host, user_agent, m) in self.early_alerts]
         
-        self.hosts_clusters.clear()
-                
-    def _create_fingerprints(self, host, http_cluster):
+        if self.on_cluster is not None:
+            self.on_cluster(host, http_cluster, early_methods)
+        else:
+            self._create_fingerprints(host, http_cluster, early_methods)
+    
+    
+    def _create_fingerprints(self, host, http_cluster, early_methods=()):
         """
             Extract GET and POST requests for each Cluster of HTTP requests
             
@@ -170,6 +553,9 @@ class Aggregator:
             ----------------
             http_cluster : list of HTTPRequest
             
+            early_methods : list of string
+                Methods whose fingerprints are not tested, because they already raised an alert (see _early_check).
+            
             Returns
             ----------------
             (get, post) : tuple (list of HTTPRequests, list of HTTPRequests)
@@ -185,7 +571,9 @@ class Aggregator:
                 method  = key[0]
                 label   = key[1]
                 cluster = value
-                self.fin_manager.store(host, self.fin_generator.generate_fingerprint(cluster, method, label))
+                self.training_batch.append((host, self.fin_generator.generate_fingerprint(cluster, method, label)))
+                if len(self.training_batch) >= TRAINING_BATCH_SIZE:
+                    self._store_training_batch()
                 
                 # If browser, store to known browser user-agents
                 if label == "Browser":
@@ -197,31 +585,124 @@ class Aggregator:
             
             user_agent = http_cluster[0].header_values.get('user-agent', None)
                     
-            self.referrerGraphs[user_agent] = referrerGraph
+            self._store_graph(user_agent, referrerGraph)
             
             for key, value in labels.items():
                 method  = key[0]
                 label   = key[1]
-                cluster = value
+                cluster = [req for req in value if not req.shed]
+                if not cluster:
+                    continue
                 new_fingerprint = self.fin_generator.generate_fingerprint(cluster, method, label)
             
                 # In OFFLINE mode, dump the generated fingerprints in a .csv file. IN THIS CASE WE APPEND!!!!
                 if self.offline == 1:
                     self.fin_manager.write_fingerprint_to_file(self.dump_testing, new_fingerprint, host)
 
+                # The cluster already raised an alert while its window was open.
+                elif method in early_methods:
+                    pass
+                
                 else:
-                    all_training_fingerprints = []
-                    for h, fingerprints in self.fin_manager.hosts_fingerprints.iteritems():
-                        for f in fingerprints:
-                            all_training_fingerprints.append(f)
-
-                    if self.detector.detection(all_training_fingerprints, new_fingerprint):
+                    if self.detector.detection(self._trained_fingerprints(), new_fingerprint):
                         self.alerts.append(new_fingerprint)
+                        if self.on_alert is not None:
+                            self.on_alert(new_fingerprint)
         
         else:
             pass
         
         
+    def _trained_fingerprints(self):
+        """ List of the fingerprints of all the hosts (the FingerprintDatabase itself, when they are in one). """
+        if isinstance(self.fin_manager, FingerprintDatabase):
+            return self.fin_manager
+        all_training_fingerprints = []
+        for h, fingerprints in self.fin_manager.hosts_fingerprints.iteritems():
+            for f in fingerprints:
+                all_training_fingerprints.append(f)
+        return all_training_fingerprints
+    
+    
+    def _early_check(self, req):
+        """
+            Test the partial fingerprint of the cluster of a request, if its outgoing information exceeds the threshold.
+            
+            Only clusters of applications that are not (and do not look like)
+            browsers are tested, as Background applications: browsers are told
+            apart from their exfiltration attempts only at the end of the window,
+            with the referrer graph. A cluster raises at most one alert per
+            window, its fingerprint is then not tested again when the window is
+            closed. After a partial fingerprint matches, the cluster is tested
+            again when its outgoing information doubles.
+            
+            Parameter
+            -------------------
+            req : HTTPRequest object
+        """
+        if self.offline == 1 or (req.method != 'GET' and req.method != 'POST'):
+            return
+        user_agent = req.header_values.get('user-agent', 'None')
+        key = (req.orig_ip, user_agent, req.method)
+        if key in self.early_alerts:
+            return
+        
+        entry = self.early_accumulators.get(key)
+        if entry is None:
+            if user_agent in self.browser_user_agents or self.detector._fake_browser([user_agent]):
+                return
+            entry = self.early_accumulators[key] = [FingerprintAccumulator(self.fin_generator, req.method, 'Background'),
+                                                    self.detector.outgoing_threshold]
+        accumulator = entry[0]
+        accumulator.add(req)
+        if accumulator.outgoing_info <= entry[1]:
+            return
+        
+        partial_fingerprint = accumulator.fingerprint()
+        if self.detector.detection(self._trained_fingerprints(), partial_fingerprint):
+            self.early_alerts.add(key)
+            del self.early_accumulators[key]
+            self.alerts.append(partial_fingerprint)
+            if self.on_alert is not None:
+                self.on_alert(partial_fingerprint)
+        else:
+            entry[1] = 2 * accumulator.outgoing_info
+    
+    
+    def _forget_early(self, host, user_agent):
+        """ Drop the early-fire state of a cluster whose window is closed. """
+        user_agent = user_agent if user_agent is not None else 'None'
+        for method in ('GET', 'POST'):
+            self.early_accumulators.pop((host, user_agent, method), None)
+            self.early_alerts.discard((host, user_agent, method))
+    
+    
+    def _store_graph(self, user_agent, referrerGraph):
+        """
+            Keep the referrer graph of a user-agent for the next windows, dropping the stale ones if they are bounded.
+        """
+        graphs = self.referrerGraphs
+        if self.max_graphs is None and self.graph_idle is None:
+            graphs[user_agent] = referrerGraph
+            return
+        
+        # Move the user-agent to the end, as the most recently updated.
+        graphs.pop(user_agent, None)
+        graphs[user_agent] = referrerGraph
+        updates = self.graph_updates
+        updates.pop(user_agent, None)
+        updates[user_agent] = self.time_current
+        
+        while updates:
+            oldest, updated = next(updates.iteritems())
+            if not ((self.max_graphs is not None and len(updates) > self.max_graphs) or
+                    (self.graph_idle is not None and self.time_current - updated > self.graph_idle)):
+                break
+            del updates[oldest]
+            graphs.pop(oldest, None)
+            self.evicted_graphs += 1
+    
+    
     def _insert_http_request(self, req):
         """
             Aggregate the HTTP requests per host and user-agent 
@@ -232,24 +713,31 @@ class Aggregator:
         """
         
         # Initialize the clusters for the (previously unseen) host
-        if req.orig_ip not in self.hosts_clusters:
-            self.hosts_clusters[req.orig_ip] = {}
+        clusters = self.hosts_clusters.get(req.orig_ip)
+        if clusters is None:
+            clusters = self.hosts_clusters[req.orig_ip] = {}
         
-        # Add a request to the cluster of a known host
-        if req.orig_ip in self.hosts_clusters:
-            
-            # Create and/or Update a cluster for those requests that DO NOT HAVE a User-Agent
-            if 'user-agent' not in req.header_values:
-                if 'None' not in self.hosts_clusters[req.orig_ip]:
-                    self.hosts_clusters[req.orig_ip]['None'] = [req]
-                else:
-                    self.hosts_clusters[req.orig_ip]['None'].append(req)
-                    
-            # Create and/or Update a cluster for those requests that DO HAVE a User-Agent
-            else:
-                if req.header_values['user-agent'] not in self.hosts_clusters[req.orig_ip]:
-                    self.hosts_clusters[req.orig_ip][req.header_values['user-agent']] = [req]
-                else:
-                    self.hosts_clusters[req.orig_ip][req.header_values['user-agent']].append(req)
+        # Create and/or Update the cluster of the User-Agent, requests that
+        # DO NOT HAVE a User-Agent are clustered under 'None'
+        user_agent = req.header_values.get('user-agent', 'None')
+        cluster = clusters.get(user_agent)
+        if cluster is None:
+            clusters[user_agent] = [req]
+            # In testing mode, the time window of a new cluster starts with its first request.
+            if self.window == 'cluster' and self.mode == 1:
+                self.sequence += 1
+                heapq.heappush(self.deadlines, (req.ts + self.timeout, self.sequence, req.orig_ip, user_agent))
+        else:
+            cluster.append(req)
+        
+        # Flush the least recently used cluster if there are too many.
+        if self.max_clusters is not None:
+            lru = self.cluster_lru
+            key = (req.orig_ip, user_agent)
+            lru.pop(key, None)
+            lru[key] = True
+            if len(lru) > self.max_clusters:
+                self._flush_cluster(*next(lru.iterkeys()))
+                self.evicted_clusters += 1
 
 
@@ -1,6 +1,7 @@
 import editdistance
 import glob
-from fingerprint import FingerprintManager
+from fingerprint import FingerprintManager, BINARY_EXTENSION
+from fingerprint_db import FingerprintDatabase
 
 class DetectionModule():
     """
@@ -21,8 +22,9 @@ class DetectionModule():
             
             Parameter
             ----------
-            host_fingerprints : list of Fingerprint
-                List of existing application fingerprints of a specific host
+            host_fingerprints : list of Fingerprint, or FingerprintDatabase
+                List of existing application fingerprints of a specific host. Only the candidates
+                that can match new_fingerprint are read from a FingerprintDatabase.
             
             new_fingerprint : Fingerprint
             
@@ -38,6 +40,10 @@ class DetectionModule():
         if new_fingerprint == None:
             return False
         
+        database = trained_fingerprints if isinstance(trained_fingerprints, FingerprintDatabase) else None
+        if database is not None:
+            trained_fingerprints = database.similarity_candidates(new_fingerprint)
+        
         # Check if new_fingerprint is similar to any existing fingerprint.
         for trained_f in trained_fingerprints:
             if self.similarity_check(new_fingerprint, trained_f):
@@ -45,7 +51,12 @@ class DetectionModule():
                 
         # Check if the new_fingerprint exfiltrates enough data to be considered as an alert.
         if new_fingerprint.outgoing_info > self.outgoing_threshold:
+            if database is not None:
+                trained_fingerprints = database.update_candidates(new_fingerprint, self.update_threhshold)
             if self._is_update(new_fingerprint, trained_fingerprints): # TODO
+                if database is not None:
+                    # The updated fingerprint was given the user-agent of new_fingerprint, save it.
+                    database.update([f for f in trained_fingerprints if f.user_agent is new_fingerprint.user_agent])
                 return False # TODO
             else:
                 return True  # It is not an update --> trigger alert.
@@ -391,10 +402,12 @@ class DetectionModule():
 
 
 class OfflineDetector:
-    def __init__(self, folder_path):
-        self.files = glob.glob(folder_path + "*.csv")
+    def __init__(self, folder_path, database=None):
+        # Fingerprints dumped in CSV and in the binary format (see fingerprint.BINARY_EXTENSION).
+        self.files = glob.glob(folder_path + "*.csv") + glob.glob(folder_path + "*" + BINARY_EXTENSION)
         self.files = sorted(self.files, key=lambda tmp: tmp[84:])
-        self.training_manager = FingerprintManager()
+        # Training fingerprints are loaded in memory, or in the SQLite database file database.
+        self.training_manager = FingerprintManager() if database is None else FingerprintDatabase(database)
         self.testing_manager = FingerprintManager()
         self.detector = DetectionModule()
         
@@ -402,7 +415,12 @@ class OfflineDetector:
     def _load_from_csv_2(self):
         """
         This method loads fingerprints from a .csv file, but only those flagged for training"
+        
+        A database that already holds fingerprints is used as it is.
         """
+        if isinstance(self.training_manager, FingerprintDatabase) and len(self.training_manager) > 0:
+            print "" + self.training_manager.filename + " has been loaded for training."
+            return
         for f in self.files:
             if "training" in f:
                 self.training_manager.read_from_file(f)
@@ -425,9 +443,12 @@ class OfflineDetector:
         total_files = 0
         total_detected = 0
         
-        for h, fingerprints in self.training_manager.hosts_fingerprints.iteritems():
-            for f in fingerprints:
-                all_training_fingerprints.append(f)
+        if isinstance(self.training_manager, FingerprintDatabase):
+            all_training_fingerprints = self.training_manager
+        else:
+            for h, fingerprints in self.training_manager.hosts_fingerprints.iteritems():
+                for f in fingerprints:
+                    all_training_fingerprints.append(f)
         
         for f in self.files:
             if "testing" in f:
@@ -0,0 +1,157 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from IPy import IP
+
+# Characters of the hostnames that may be IP addresses: dotted IPv4 (or network), or IPv6 (which contains ':').
+_IP_CHARACTERS = frozenset('0123456789./')
+
+# Key of the kind of rule ending at a node of the trie of public suffixes.
+_KIND = None
+_RULE, _EXCEPTION = 'rule', 'exception'
+
+
+class DomainNormalizer:
+    """
+    Registered domain of hostnames (e.g., www.bbc.co.uk ---> bbc.co.uk), with a bounded LRU cache.
+
+    Without a public suffix list the registered domain is made of the last
+    two labels of the hostname (www.bbc.co.uk ---> co.uk), like DECANTeR
+    always did, and like the host_domain column precomputed by
+    decanter_dump_input.bro. With a public suffix list (the
+    public_suffix_list.dat file of https://publicsuffix.org, loaded from a
+    local file) it is the public suffix and the label before it. Rules are
+    compiled in a trie of labels, from the top-level domain down, with
+    wildcard ('*.ck') and exception ('!www.ck') rules.
+
+    Hostnames that are IP addresses are returned as is. Only hostnames made
+    of digits, dots and slashes, or containing ':', are checked with IPy.
+
+    The cache is shared by the threads of the pipeline (see pipeline.Pipeline).
+    """
+
+    def __init__(self, suffix_file=None, cache_size=65536):
+        """
+            Parameters
+            -------------
+            suffix_file : string, default = None
+                Public suffix list. None to use the last two labels.
+
+            cache_size : int, default = 65536
+                Hostnames whose registered domain is kept, least recently used are dropped first.
+        """
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.suffixes = None
+        # SHA-1 of the public suffix list file, None without one.
+        self.suffix_digest = None
+        if suffix_file is not None:
+            self.load(suffix_file)
+
+
+    def load(self, suffix_file):
+        """
+            Use the rules of a public suffix list file (UTF-8, one rule per line, // for comments)
+
+            Parameter
+            -------------
+            suffix_file : string
+        """
+        trie = {}
+        digest = hashlib.sha1()
+        with open(suffix_file, 'rb') as f:
+            for line in f:
+                digest.update(line)
+                line = line.strip()
+                if not line or line.startswith('//'):
+                    continue
+                rule = line.split()[0].decode('utf-8').lower()
+                kind = _RULE
+                if rule.startswith('!'):
+                    rule, kind = rule[1:], _EXCEPTION
+                node = trie
+                for label in reversed(rule.split('.')):
+                    # Hostnames in the Host header are encoded in ASCII (punycode).
+                    label = label.encode('idna') if label != '*' else '*'
+                    node = node.setdefault(label, {})
+                node[_KIND] = kind
+        with self.lock:
+            self.suffixes = trie
+            self.suffix_digest = digest.hexdigest()
+            self.cache.clear()
+
+
+    def registered_domain(self, hostname):
+        """
+            Registered domain of a hostname, or the hostname itself if it is an IP address
+
+            Parameter
+            -------------
+            hostname : string
+                Hostname value in the "Host" HTTP header field.
+
+            Return
+            -------------
+            domain : string
+        """
+        with self.lock:
+            domain = self.cache.pop(hostname, None)
+            if domain is not None:
+                self.cache[hostname] = domain
+                return domain
+        domain = self._registered_domain(hostname)
+        with self.lock:
+            self.cache[hostname] = domain
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return domain
+
+
+    def _registered_domain(self, hostname):
+        if ':' in hostname or _IP_CHARACTERS.issuperset(hostname):
+            try:
+                IP(hostname)
+                return hostname
+            except ValueError:
+                pass
+        if self.suffixes is None:
+            return ".".join(hostname.split('.')[-2:])
+
+        name = hostname[:-1] if hostname.endswith('.') else hostname
+        labels = name.split('.')
+        length = self._suffix_length([label.lower() for label in reversed(labels)])
+        if length >= len(labels):
+            # The hostname is a public suffix.
+            return name
+        return ".".join(labels[-length - 1:])
+
+
+    def _suffix_length(self, labels):
+        """ Number of labels of the public suffix, labels from the top-level domain down. """
+        # Unlisted top-level domains are public suffixes (the default '*' rule).
+        length = 1
+        nodes = [self.suffixes]
+        for depth, label in enumerate(labels, 1):
+            matched = []
+            for node in nodes:
+                for key in (label, '*'):
+                    child = node.get(key)
+                    if child is None:
+                        continue
+                    kind = child.get(_KIND)
+                    # An exception rule prevails, its public suffix is the rule without its first label.
+                    if kind == _EXCEPTION:
+                        return depth - 1
+                    if kind == _RULE:
+                        length = max(length, depth)
+                    matched.append(child)
+            if not matched:
+                break
+            nodes = matched
+        return length
+
+
+# Normalizer shared by the fingerprints (FingerprintGenerator._parse) and the referrer graphs
+# (ReferrerGraph._isLinked_). Load a public suffix list in it with normalizer.load().
+normalizer = DomainNormalizer()
@@ -4,14 +4,21 @@
 from   .dumont_log import DumontLog
 from   brothon     import bro_log_reader
 import pandas as pd
+from   header_decoder import parse_header_values
+from   log_cache      import ParsedLogCache
+from   bro_reader     import JsonBroLog, MappedBroLog, detect_format, is_compressed
 
-def parseLOG(filename):
+def parseLOG(filename, cache_dir=None):
     """ Generate a list of Dumont Requests from a bro log file 
         
         Parameters
         ----------
         filename : string
             path to .pcap file to parse.
+            
+        cache_dir : string, default = None
+            folder of the parsed-log cache shared with DECANTeR
+            (see log_cache.ParsedLogCache). No cache is used when None.
         
         Returns
         -------
@@ -21,9 +28,11 @@ def parseLOG(filename):
         """
     DumontRequests = []
     
-    bro_log = bro_log_reader.BroLogReader(filename)
-    data = pd.DataFrame(bro_log.readrows())
-    data['header_values'] = data['header_values'].apply(__parseHeaderValues__)
+    if cache_dir is not None:
+        rows = ParsedLogCache(cache_dir).rows(filename, lambda: __readRawRows__(filename), variant='brothon')
+    else:
+        rows = __readRows__(filename)
+    data = pd.DataFrame(list(rows))
     
     for d in data.iterrows():
         if d[1]['method'] == 'GET' or  d[1]['method'] == 'POST':
@@ -31,27 +40,19 @@ def parseLOG(filename):
         
     return aggregateTemporalFeatures(DumontRequests)
     
-def __parseHeaderValues__(headerValues):
-    """ Parse header values from BRO encoding to dictionary.
-
-        Parameters
-        ----------
-        headerValues : string
-            header value in bro format
-            
-        Returns
-        -------
-        result : dict
-            header value in dict format
-
-        """
-    if headerValues == '-':
-        return dict()
-    else:        
-        return  dict((x, y) for x, y in\
-                list(map(\
-                lambda entry: (entry.split('||')[0].lower(), entry.split('||')[1].replace('\\x2c', ',')),\
-                headerValues.split(','))))
+def __readRows__(filename):
+    """ Read the rows of a bro log file, decoding their header values """
+    for row in __readRawRows__(filename):
+        row['header_values'] = parse_header_values(row['header_values'])
+        yield row
+    
+def __readRawRows__(filename):
+    """ Read the rows of a bro log file, in ASCII or JSON format, plain or compressed """
+    if detect_format(filename) == 'json':
+        return JsonBroLog(filename, fields=None).readrows()
+    if is_compressed(filename):
+        return MappedBroLog(filename, fields=None).readrows()
+    return bro_log_reader.BroLogReader(filename).readrows()
     
 def aggregateTemporalFeatures(DumontRequests):
     """ Auxiliary method to aggregate t1 and t2 features of Dumont requests 
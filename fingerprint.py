@@ -1,8 +1,27 @@
 import ast
-from IPy import IP
+import domains
 import editdistance
 from urlparse import urlparse
+from array import array
 import csv
+import Queue
+import struct
+import sys
+import threading
+import time
+
+# Binary fingerprint files: magic string and version of the format, and extension of the files.
+BINARY_MAGIC = 'DFPB'
+BINARY_VERSION = 1
+BINARY_EXTENSION = '.fpb'
+
+# Count of a list feature that is None (e.g., the constant headers of a Browser fingerprint).
+_NONE = 0xFFFFFFFF
+
+
+class FingerprintFormatError(Exception):
+    """ Raised when a binary fingerprint file is not valid, or of another version of the format. """
+    pass
 
 
 class Fingerprint():
@@ -82,9 +101,18 @@ class FingerprintGenerator():
     Object that is responsible of generating a fingerprint.
     """
 
-    def __init__(self):
+    def __init__(self, outgoing_bound=None):
+        """
+            Parameter
+            ----------------
+            outgoing_bound : int, default = None
+                Once the outgoing information of a fingerprint exceeds the
+                bound, it is not computed further: it is exact up to the bound,
+                and a lower bound of the exact value above it (see
+                _compute_outgoing_info). None to always compute it exactly.
+        """
         self.counter_req = 0
-        pass
+        self.outgoing_bound = outgoing_bound
 
     
     def generate_fingerprint(self, method_cluster, method_name, label):
@@ -114,109 +142,20 @@ class FingerprintGenerator():
                 Fingerprint of the cluster of HTTP requests
         """
         
-        # Temporary variables needed for fingerprint generation
-        cache = []
-        total_size_headers = 0
-        tmp_headers = {}
-        number_requests = len(method_cluster)
         self.counter_req += len(method_cluster)
         
-        # Features for fingerprints
-        #label = ""
-        hosts = dict()
-        ip_dsts = []
-        constant_header_fields = []
-        average_size = 0.0
-        user_agent = []
-        language = []
-        outgoing_info = 0
-        
-        # Used for evasion analysis
-        is_malicious = '1' if '1' in [m.is_malicious for m in method_cluster] else '0'
-        
         # Return None if there are no request to analyze. (i.e., fingerprint does not exist)
         if not method_cluster:
             return None
         
+        accumulator = FingerprintAccumulator(self, method_name, label, self.outgoing_bound)
         for http_request in method_cluster:
-            
-            # Add hostname
-            if 'host' in http_request.header_values:
-                hostname = http_request.header_values.get('host')
-                clean_hostname = self._parse(hostname)
-                hosts[clean_hostname] = hosts.get(clean_hostname, 0) + 1
-                    
-            # Add destination ip
-            if http_request.dest_ip != None:
-                if http_request.dest_ip not in ip_dsts:
-                    ip_dsts.append(http_request.dest_ip)
-
-            # Add user-agent
-            if 'user-agent' in http_request.header_values:
-                if http_request.header_values.get('user-agent') not in user_agent:
-                    user_agent.append(http_request.header_values.get('user-agent'))
-            else:
-                # Add a default string for user-agent
-                if 'None' not in user_agent:
-                    user_agent.append('None')
-
-            # Add languange
-            if 'accept-language' in http_request.header_values:
-                if http_request.header_values.get('accept-language') not in language:
-                    language.append(http_request.header_values.get('accept-language'))
-       
-    
-            uri_length = len(http_request.uri)
-            # Case 1 : First HTTP Request
-            if not cache:
-                # Add first request to the cache
-                cache.append(http_request)
-                
-                # Update the total size of the header with the size of each part of the HTTP request
-                total_size_headers += uri_length
-                total_size_headers += http_request.req_body_len
-                for header_name in http_request.header_values.keys():
-                    total_size_headers += len(header_name)
-                    total_size_headers += len(http_request.header_values[header_name])
-                    tmp_headers[header_name] = 1
-                
-                # Update outgoing information
-                outgoing_info = total_size_headers
-      
-            # Case 2 : non-First HTTP Request
-            else:
-                
-                # Update outgoing information
-                outgoing_info = self._compute_outgoing_info(http_request, cache[0], outgoing_info, cache)
-                
-                # Update the total size of the header with the size of each part of the HTTP request
-                total_size_headers += uri_length
-                total_size_headers += http_request.req_body_len
-                for header_name in http_request.header_values.keys():
-                    total_size_headers += len(header_name)
-                    total_size_headers += len(http_request.header_values[header_name])
-                    if header_name not in tmp_headers:
-                        tmp_headers[header_name] = 1
-                    else:
-                        tmp_headers[header_name] += 1
-                        
+            accumulator.add(http_request)
         
-        # Set Constant Header Fields
-        for key, val in tmp_headers.iteritems():
-            if val == number_requests:
-                constant_header_fields.append(key)
-                
-        # Set Average Size
-        average_size = total_size_headers / float(number_requests)
-               
-        # Generate Fingerprint for the given cluster of HTTP requests
-        finger = Fingerprint(label, user_agent, hosts.items(), ip_dsts, constant_header_fields, language, average_size,
-                             outgoing_info, method_name, is_malicious)
+        return accumulator.fingerprint()
         
-        return finger
         
-        
-    def _compute_outgoing_info(self, current_req, old_req, outgoing_info, cache):
+    def _compute_outgoing_info(self, current_req, old_req, outgoing_info, cache, bound=None):
         """
             Compute Outgoing information and update the cache.
             
@@ -224,6 +163,11 @@ class FingerprintGenerator():
             previously analyzed HTTP request. Once the comparison is finished, the old request is removed
             from the cache, and the current request is added in the cache.
             
+            With a bound, every edit distance is only computed if it can keep the outgoing information
+            within the bound, and no distance is computed once the bound is exceeded. Distances are never
+            negative, so the result is the exact value when it is not above the bound, and otherwise it
+            is above the bound (and not above the exact value).
+            
             Parameter
             ------------
             current_req : HTTPRequest
@@ -237,6 +181,9 @@ class FingerprintGenerator():
                 
             cache : list of HTTPRequest
                 List containing the previous HTTPRequest (i.e., old_req)
+            
+            bound : int, default = None
+                Bound of the outgoing information, None to compute it exactly.
                 
             Return
             ------------
@@ -248,16 +195,30 @@ class FingerprintGenerator():
             outgoing_info += current_req.req_body_len
             return outgoing_info
         
-        outgoing_info += self._levenshtein_distance(current_req.uri, old_req.uri)
-        outgoing_info += current_req.req_body_len
+        if bound is None:
+            outgoing_info += self._levenshtein_distance(current_req.uri, old_req.uri)
+            outgoing_info += current_req.req_body_len
+            
+            # Compute Outgoing information for each header name in the request
+            for header_name in current_req.header_values.keys():
+                if header_name not in old_req.header_values:
+                    outgoing_info += len(current_req.header_values[header_name])
+                else:
+                    outgoing_info += self._levenshtein_distance(current_req.header_values[header_name], 
+                                                          old_req.header_values[header_name] )
         
-        # Compute Outgoing information for each header name in the request
-        for header_name in current_req.header_values.keys():
-            if header_name not in old_req.header_values:
-                outgoing_info += len(current_req.header_values[header_name])
-            else:
-                outgoing_info += self._levenshtein_distance(current_req.header_values[header_name], 
-                                                      old_req.header_values[header_name] )
+        elif outgoing_info <= bound:
+            outgoing_info += self._bounded_distance(current_req.uri, old_req.uri, bound - outgoing_info)
+            outgoing_info += current_req.req_body_len
+            
+            old_header_values = old_req.header_values
+            for header_name, value in current_req.header_values.iteritems():
+                if outgoing_info > bound:
+                    break
+                if header_name not in old_header_values:
+                    outgoing_info += len(value)
+                else:
+                    outgoing_info += self._bounded_distance(value, old_header_values[header_name], bound - outgoing_info)
         
         # Update cache
         cache.pop()
@@ -265,34 +226,54 @@ class FingerprintGenerator():
         return outgoing_info
     
     
-    def _parse(self, hostname):
+    def _header_size(self, http_request):
         """
-            Extract the top level domain (TLD) and second level domain (SLD) from a hostname string. 
+            Total length of the header names and values of an HTTP request.
+            
+            Parameter
+            ------------
+            http_request : HTTPRequest
+            
+            Return
+            ------------
+            size : int
+                header_bytes, if it was precomputed in the log, otherwise the
+                sum of the lengths of the decoded header names and values
+        """
+        if http_request.header_bytes is not None:
+            return http_request.header_bytes
+        size = 0
+        for header_name, header_value in http_request.header_values.iteritems():
+            size += len(header_name) + len(header_value)
+        return size
+    
+    
+    def _parse(self, hostname, hint=None):
+        """
+            Extract the registered domain from a hostname string (see domains.DomainNormalizer). 
             
             E.g., Input: www.google.com ---> Output google.com
             
             If the hostname is a valid IP address, it is returned as is.
             
-            Parameter
+            Parameters
             ------------
             hostname : string
                 Hostname value in the "Host" HTTP header field
+            
+            hint : string, default = None
+                Domain precomputed in the log (host_domain). It is made of the
+                last two labels of the hostname, so it is only used when no
+                public suffix list is loaded.
                 
             Return
             ------------
             top_domains  : string
-                String containing second and top level domain
+                String containing the registered domain
         """
-        
-        # Check if the hostname represents an IP address, if so returns its string value
-        try:
-            IP(hostname)
-            return hostname
-            
-        # Otherwise parse the hostname as a URL. We need the top level domain and second level domain.
-        except ValueError:
-            top_domains = ".".join(hostname.split('.')[-2:])
-            return top_domains
+        if hint is not None and domains.normalizer.suffixes is None:
+            return hint
+        return domains.normalizer.registered_domain(hostname)
         
 
     def _levenshtein_distance(self, s1, s2):
@@ -310,15 +291,287 @@ class FingerprintGenerator():
             
             """
         
+        # Header values are interned (see decanter_new.HTTPRequest), equal values are often the same object.
+        if s1 is s2:
+            return 0
+        return editdistance.eval(s1, s2)
+    
+    
+    def _bounded_distance(self, s1, s2, limit):
+        """ Compute the Levenshtein distance if it is not above limit, otherwise return a value above limit.
+            
+            The distance is at least the difference of the lengths of the strings, so
+            it is only computed when that difference is not above limit.
+            
+            Parameter
+            -----------
+            s1, s2 : string
+                Two strings to compare
+            
+            limit : int
+                
+            Result
+            -----------
+            distance : int
+            
+            """
+        if s1 is s2 or s1 == s2:
+            return 0
+        if abs(len(s1) - len(s2)) > limit:
+            return limit + 1
         return editdistance.eval(s1, s2)
 
 
+class FingerprintAccumulator():
+    """
+    Features of a fingerprint, updated one HTTP request at a time.
+    
+    Only the last HTTP request added is kept (to compute the outgoing
+    information of the next one), so requests can be fingerprinted as they are
+    streamed. Adding the requests of a cluster in order gives the same
+    fingerprint as FingerprintGenerator.generate_fingerprint.
+    """
+    
+    def __init__(self, generator, method_name, label, outgoing_bound=None):
+        """
+            Parameter
+            ----------------
+            generator : FingerprintGenerator
+                Generator whose helpers (outgoing information, header size,
+                domain parsing) are used.
+                
+            method_name : string
+                Name of the method of HTTP requests (i.e., GET or POST)
+                
+            label : string
+                Type of the HTTP request (i.e. Browser or Background)
+            
+            outgoing_bound : int, default = None
+                Bound of the outgoing information (see FingerprintGenerator).
+        """
+        self.generator = generator
+        self.method_name = method_name
+        self.label = label
+        self.outgoing_bound = outgoing_bound
+        
+        # Temporary variables needed for fingerprint generation
+        self.cache = []
+        self.number_requests = 0
+        self.total_size_headers = 0
+        self.tmp_headers = {}
+        
+        # Features for fingerprints
+        self.hosts = dict()
+        self.ip_dsts = []
+        self.user_agent = []
+        self.language = []
+        self.outgoing_info = 0
+        self.is_malicious = '0'
+        
+        # Values already in the lists above, lists keep the order in which values were seen.
+        self.seen_ip_dsts = set()
+        
+        
+    def add(self, http_request):
+        """
+            Update the features with an HTTP request.
+            
+            Parameter
+            ----------------
+            http_request : HTTPRequest
+        """
+        generator = self.generator
+        header_values = http_request.header_values
+        self.number_requests += 1
+        
+        # Used for evasion analysis
+        if http_request.is_malicious == '1':
+            self.is_malicious = '1'
+        
+        # Add hostname
+        if 'host' in header_values:
+            clean_hostname = generator._parse(header_values['host'], http_request.host_domain)
+            self.hosts[clean_hostname] = self.hosts.get(clean_hostname, 0) + 1
+        
+        # Add destination ip
+        if http_request.dest_ip != None and http_request.dest_ip not in self.seen_ip_dsts:
+            self.seen_ip_dsts.add(http_request.dest_ip)
+            self.ip_dsts.append(http_request.dest_ip)
+        
+        # Add user-agent, or a default string if it is missing
+        user_agent = header_values.get('user-agent', 'None')
+        if user_agent not in self.user_agent:
+            self.user_agent.append(user_agent)
+        
+        # Add languange
+        if 'accept-language' in header_values:
+            if header_values['accept-language'] not in self.language:
+                self.language.append(header_values['accept-language'])
+        
+        # Update the total size of the header with the size of each part of the HTTP request
+        size = len(http_request.uri) + http_request.req_body_len + generator._header_size(http_request)
+        self.total_size_headers += size
+        tmp_headers = self.tmp_headers
+        for header_name in header_values:
+            tmp_headers[header_name] = tmp_headers.get(header_name, 0) + 1
+        
+        # Update outgoing information: the first request counts as a whole, the
+        # others by their difference with the previous one.
+        if not self.cache:
+            self.cache.append(http_request)
+            self.outgoing_info = size
+        else:
+            self.outgoing_info = generator._compute_outgoing_info(http_request, self.cache[0], self.outgoing_info, self.cache,
+                                                                  self.outgoing_bound)
+            
+            
+    def fingerprint(self):
+        """
+            Generate the fingerprint of the HTTP requests added so far.
+            
+            Returns
+            ----------------
+            finger : Fingerprint(), or None if no request was added
+        """
+        if not self.number_requests:
+            return None
+        
+        # Set Constant Header Fields
+        constant_header_fields = [key for key, val in self.tmp_headers.iteritems() if val == self.number_requests]
+        
+        # Set Average Size
+        average_size = self.total_size_headers / float(self.number_requests)
+        
+        return Fingerprint(self.label, self.user_agent, self.hosts.items(), self.ip_dsts, constant_header_fields, self.language,
+                           average_size, self.outgoing_info, self.method_name, self.is_malicious)
+
+
+class FingerprintWriter(object):
+    """
+    Append fingerprints to a CSV or binary file (see BINARY_EXTENSION), in batches.
+    
+    Fingerprints are kept in memory and written at once when batch_size of
+    them are waiting, when the oldest has been waiting for max_delay seconds
+    (checked at every write), and with flush() or close(). The file is kept
+    open between batches, and opened again after close(). With background,
+    batches are written by a thread, so that the caller does not wait for
+    the disk.
+    """
+    
+    def __init__(self, filename, batch_size=1000, max_delay=5.0, background=False):
+        """
+            Parameters
+            -------------
+            filename : string
+            
+            batch_size : int, default = 1000
+                Fingerprints written at once.
+            
+            max_delay : float, default = 5.0
+                Seconds after which waiting fingerprints are written, at the next write.
+            
+            background : boolean, default = False
+                Write the batches with a thread.
+        """
+        self.filename = filename
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.background = background
+        self.batch = []
+        self.first = None
+        self.file = None
+        self.queue = None
+        self.thread = None
+        self.failure = None
+    
+    
+    def __getstate__(self):
+        # The waiting fingerprints are written, the file and the thread belong to the running process.
+        self.close()
+        state = self.__dict__.copy()
+        state['batch'] = []
+        return state
+    
+    
+    def write(self, host, fingerprint):
+        if not self.batch:
+            self.first = time.time()
+        self.batch.append((host, fingerprint))
+        if len(self.batch) >= self.batch_size or time.time() - self.first >= self.max_delay:
+            self.flush()
+    
+    
+    def flush(self):
+        """ Write the waiting fingerprints (with background, pass them to the thread). """
+        self._check_failure()
+        batch, self.batch = self.batch, []
+        if not batch:
+            return
+        if not self.background:
+            self._write(batch)
+            return
+        if self.thread is None:
+            self.queue = Queue.Queue()
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+        self.queue.put(batch)
+    
+    
+    def close(self):
+        """ Write the waiting fingerprints, wait for the thread and close the file. """
+        self.flush()
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = self.queue = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self._check_failure()
+    
+    
+    def _write(self, batch):
+        if self.file is None:
+            self.file = open(self.filename, 'ab')
+        if self.filename.endswith(BINARY_EXTENSION):
+            if self.file.tell() == 0:
+                self.file.write(_binary_header())
+            # A batch is a block of the binary format.
+            self.file.write(_encode_block(batch))
+        else:
+            writer = csv.writer(self.file, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+            writer.writerows([fingerprint.to_csv() + [host] for host, fingerprint in batch])
+        self.file.flush()
+    
+    
+    def _run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            if self.failure is None:
+                try:
+                    self._write(batch)
+                except Exception:
+                    self.failure = sys.exc_info()
+    
+    
+    def _check_failure(self):
+        if self.failure is not None:
+            failure, self.failure = self.failure, None
+            raise failure[0], failure[1], failure[2]
+
+
 class FingerprintManager():
     """
     Object used to loads/load fingerprints from/to files or to store them temporarily in a dictionary.
     """
-    def __init__(self):
+    def __init__(self, batch_size=1000, max_delay=5.0, background=False):
         self.hosts_fingerprints = {}
+        # Filename -> FingerprintWriter of the files fingerprints are appended to (see FingerprintWriter).
+        self.writers = {}
+        self.writer_options = {'batch_size': batch_size, 'max_delay': max_delay, 'background': background}
         
     
     def store(self, host, new_fingerprint):
@@ -331,6 +584,12 @@ class FingerprintManager():
                 self.hosts_fingerprints[host].append(new_fingerprint)
     
     
+    # Store (host, fingerprint) pairs, like FingerprintDatabase.store_many.
+    def store_many(self, items):
+        for host, new_fingerprint in items:
+            self.store(host, new_fingerprint)
+    
+    
     def get_host_fingerprints(self, host):
         return self.hosts_fingerprints.get(host, None)
     
@@ -343,7 +602,13 @@ class FingerprintManager():
     
     
     # We can use this method to dump the fingerprints after analyzing one log.
+    # Files with the BINARY_EXTENSION are written in the binary format, otherwise in CSV.
     def write_to_file(self, filename):
+        if filename.endswith(BINARY_EXTENSION):
+            with open(filename, 'wb') as ofile:
+                ofile.write(_binary_header())
+                ofile.write(_encode_block([(host, f) for host, fingerp in self.hosts_fingerprints.iteritems() for f in fingerp]))
+            return
         ofile = open(filename, 'wb')
         writer = csv.writer(ofile, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
         for host,fingerp in self.hosts_fingerprints.iteritems():
@@ -356,18 +621,29 @@ class FingerprintManager():
     
     # Give in input a single fingerprint and dump it into a file. IN THIS CASE WE APPEND, because in testing we get
     # fingerprints every X minutes, so they are appended as soon as they are created. 
+    # Fingerprints are written in batches, use flush_files() or close_files() to write them all.
     def write_fingerprint_to_file(self, filename, fingerprint, host):
         if fingerprint is None:
             return
-        ofile = open(filename, 'a')
-        writer = csv.writer(ofile, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
-        input_csv = fingerprint.to_csv()
-        input_csv.append(host)
-        writer.writerow(input_csv)
-        ofile.close()
+        writer = self.writers.get(filename)
+        if writer is None:
+            writer = self.writers[filename] = FingerprintWriter(filename, **self.writer_options)
+        writer.write(host, fingerprint)
         return
     
     
+    def flush_files(self):
+        """ Write the fingerprints waiting to be appended to their files. """
+        for writer in self.writers.itervalues():
+            writer.flush()
+    
+    
+    def close_files(self):
+        """ Write the fingerprints waiting to be appended to their files, and close them. """
+        for writer in self.writers.itervalues():
+            writer.close()
+    
+    
     # Generate a Fingerprint from a CVS row.
     def from_cvs(self, row):
         label = row[0]
@@ -394,6 +670,10 @@ class FingerprintManager():
     
     # We can use this method to read the "trained" fingerprints.
     def read_from_file(self, filename):
+        if filename.endswith(BINARY_EXTENSION):
+            for host, fingerprint in read_binary_fingerprints(filename):
+                self.store(filename, fingerprint)
+            return
         with open(filename, 'rb') as f:
             reader = csv.reader(f)
             for row in reader:
@@ -401,3 +681,165 @@ class FingerprintManager():
                 self.store(filename, self.from_cvs(row))
         return
 
+
+# Binary fingerprint format
+#
+# The file starts with BINARY_MAGIC and BINARY_VERSION (uint16), followed by
+# blocks. Each block is prefixed by its length (uint32) and contains:
+#
+# - the number of strings, of records and of integers of the records (uint32);
+# - the length of every string (uint32) and the strings, one after the other;
+# - the records, as integers (uint32): every record is prefixed by its number
+#   of integers, and strings are given by their index in the block;
+# - average size and outgoing information of every record (float64, the
+#   average size is NaN when it is None).
+#
+# A record is label, method, host, is_malicious, then user-agents, hosts
+# (pairs of string and count), destination IPs, constant headers and
+# languages, each prefixed by its count (_NONE when the feature is None).
+# Numbers are little-endian. Every batch of fingerprints appended to a file
+# (see FingerprintWriter) is a block.
+
+
+def _binary_header():
+    return BINARY_MAGIC + struct.pack('<H', BINARY_VERSION)
+
+
+def _little_endian(a):
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a.tostring()
+
+
+def _encode_block(items):
+    """ Encode a list of (host, Fingerprint) in a block of the binary format. """
+    codes = {}
+    strings = []
+    
+    def code(value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif not isinstance(value, str):
+            value = str(value)
+        c = codes.get(value)
+        if c is None:
+            c = codes[value] = len(strings)
+            strings.append(value)
+        return c
+    
+    def add_list(record, values):
+        if values is None:
+            record.append(_NONE)
+        else:
+            record.append(len(values))
+            record.extend(code(v) for v in values)
+    
+    ints = array('I')
+    floats = array('d')
+    for host, f in items:
+        record = [code(f.label), code(f.method), code(host), code(f.is_malicious)]
+        add_list(record, f.user_agent)
+        record.append(len(f.hosts))
+        for name, count in f.hosts:
+            record.append(code(name))
+            record.append(count)
+        add_list(record, f.ip_dsts)
+        add_list(record, f.constant_header_fields)
+        # Like in CSV, the languages are only kept for Browser fingerprints.
+        add_list(record, f.language if f.label != "Background" else None)
+        ints.append(len(record))
+        ints.extend(record)
+        floats.append(f.avg_size if f.avg_size is not None else float('nan'))
+        floats.append(f.outgoing_info)
+    
+    lengths = array('I', [len(v) for v in strings])
+    block = ''.join([struct.pack('<III', len(strings), len(items), len(ints)), _little_endian(lengths), ''.join(strings),
+                     _little_endian(ints), _little_endian(floats)])
+    return struct.pack('<I', len(block)) + block
+
+
+def _decode_array(typecode, data):
+    a = array(typecode)
+    a.fromstring(data)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a.tolist()
+
+
+def _decode_block(block):
+    """ Decode a block of the binary format, return a list of (host, Fingerprint). """
+    n_strings, n_records, n_ints = struct.unpack_from('<III', block)
+    offset = 12
+    lengths = _decode_array('I', block[offset:offset + 4 * n_strings])
+    offset += 4 * n_strings
+    strings = []
+    for length in lengths:
+        strings.append(block[offset:offset + length])
+        offset += length
+    ints = _decode_array('I', block[offset:offset + 4 * n_ints])
+    offset += 4 * n_ints
+    floats = _decode_array('d', block[offset:offset + 16 * n_records])
+    
+    result = []
+    i = 0
+    for r in xrange(n_records):
+        end = i + 1 + ints[i]
+        values = ints[i + 1:end]
+        i = end
+        label, method, host, is_malicious = [strings[c] for c in values[:4]]
+        j = 4
+        features = []
+        for feature in ('user_agent', 'hosts', 'ip_dsts', 'constant_header_fields', 'language'):
+            count = values[j]
+            j += 1
+            if count == _NONE:
+                features.append(None)
+            elif feature == 'hosts':
+                pairs = values[j:j + 2 * count]
+                features.append([(strings[c], int(n)) for c, n in zip(pairs[::2], pairs[1::2])])
+                j += 2 * count
+            else:
+                features.append([strings[c] for c in values[j:j + count]])
+                j += count
+        user_agent, hosts, ip_dsts, const_head, language = features
+        avg_size, outgoing_info = floats[2 * r], floats[2 * r + 1]
+        if avg_size != avg_size:
+            avg_size = None
+        result.append((host, Fingerprint(label, user_agent, hosts, ip_dsts, const_head, language, avg_size, outgoing_info,
+                                         method, is_malicious)))
+    return result
+
+
+def read_binary_fingerprints(filename):
+    """
+        Read a binary fingerprint file
+        
+        Parameter
+        ------------
+        filename : string
+        
+        Return
+        ------------
+        result : list of (string, Fingerprint)
+            Host and fingerprint of every record, in the order of the file.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    header = _binary_header()
+    if not data.startswith(BINARY_MAGIC):
+        raise FingerprintFormatError('{} is not a binary fingerprint file.'.format(filename))
+    if not data.startswith(header):
+        raise FingerprintFormatError('{} was written with another version of the binary fingerprint format.'.format(filename))
+    
+    result = []
+    offset = len(header)
+    while offset < len(data):
+        if offset + 4 > len(data):
+            raise FingerprintFormatError('{} is truncated.'.format(filename))
+        length, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        if offset + length > len(data):
+            raise FingerprintFormatError('{} is truncated.'.format(filename))
+        result.extend(_decode_block(data[offset:offset + length]))
+        offset += length
+    return result
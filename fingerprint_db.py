@@ -0,0 +1,267 @@
+import csv
+import os
+import sqlite3
+from fingerprint import FingerprintManager, BINARY_EXTENSION, _encode_block, _decode_block, read_binary_fingerprints
+
+# Version of the schema, kept in the user_version of the database.
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    id INTEGER PRIMARY KEY,
+    host TEXT NOT NULL,
+    label TEXT NOT NULL,
+    method TEXT,
+    user_agent TEXT,
+    ua_length INTEGER,
+    record BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fingerprints_host ON fingerprints (host);
+CREATE INDEX IF NOT EXISTS fingerprints_label_ua ON fingerprints (label, user_agent);
+CREATE INDEX IF NOT EXISTS fingerprints_label_method ON fingerprints (label, method, ua_length);
+CREATE TABLE IF NOT EXISTS fingerprint_domains (
+    fingerprint INTEGER NOT NULL REFERENCES fingerprints (id),
+    domain TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fingerprint_domains_domain ON fingerprint_domains (domain);
+"""
+
+
+class FingerprintDatabaseError(Exception):
+    """ Raised when a fingerprint database was created with another version of the schema. """
+    pass
+
+
+class FingerprintDatabase(object):
+    """
+    Fingerprints stored in a SQLite database, instead of in memory like the FingerprintManager.
+
+    Fingerprints are kept by host, and indexed by host, label, method and
+    user-agent (the first one of the fingerprint), and by the domains they
+    contacted. DetectionModule.detection accepts a FingerprintDatabase in place
+    of the list of trained fingerprints: only the candidates that can be
+    similar to a new fingerprint (or that it can be an update of) are read
+    from the database, so the size of the model is not bounded by memory.
+
+    Every fingerprint is a record of the binary fingerprint format (see
+    fingerprint.BINARY_EXTENSION). The database is a local file, opened again
+    when the object is unpickled (e.g., from a checkpoint) or used by a forked
+    process (e.g., a shard of sharding.ShardedAggregator).
+    """
+
+    def __init__(self, filename, batch_size=1000, max_delay=5.0, background=False):
+        """
+            Parameters
+            -------------
+            filename : string
+                SQLite database file, created if it does not exist.
+            
+            batch_size, max_delay, background :
+                Options of the writers of the fingerprints dumped to files (see FingerprintManager).
+        """
+        self.filename = filename
+        # Fingerprints dumped to files are not stored in the database.
+        self.dumps = FingerprintManager(batch_size, max_delay, background)
+        self._connection = None
+        self._pid = None
+
+
+    @property
+    def connection(self):
+        # SQLite connections must not be used across a fork.
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = connection = sqlite3.connect(self.filename)
+            self._pid = os.getpid()
+            connection.text_factory = str
+            # Readers (e.g., the shards) are not blocked while fingerprints are written.
+            connection.execute('PRAGMA journal_mode = WAL')
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            if version == 0:
+                with connection:
+                    connection.executescript(_SCHEMA)
+                    connection.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+            elif version != SCHEMA_VERSION:
+                raise FingerprintDatabaseError('{} has version {} of the schema, instead of {}.'.format(
+                    self.filename, version, SCHEMA_VERSION))
+        return self._connection
+
+
+    def __getstate__(self):
+        return {'filename': self.filename, 'dumps': self.dumps}
+
+
+    def __setstate__(self, state):
+        self.__init__(state['filename'])
+        self.dumps = state['dumps']
+
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM fingerprints').fetchone()[0]
+
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+
+    def store(self, host, new_fingerprint):
+        """ Store the fingerprint of a host (see FingerprintManager.store) """
+        if new_fingerprint is None:
+            return
+        self.store_many([(host, new_fingerprint)])
+
+
+    def store_many(self, items):
+        """
+            Store many fingerprints at once, in one transaction
+
+            Parameter
+            -------------
+            items : iterable of (string, Fingerprint)
+                Host and fingerprint.
+        """
+        connection = self.connection
+        with connection:
+            for host, fingerprint in items:
+                if fingerprint is None:
+                    continue
+                ua = _text(fingerprint.user_agent[0]) if fingerprint.user_agent else None
+                cursor = connection.execute('INSERT INTO fingerprints (host, label, method, user_agent, ua_length, record) '
+                                            'VALUES (?, ?, ?, ?, ?, ?)',
+                                            (_text(host), fingerprint.label, fingerprint.method, ua,
+                                             len(ua) if ua is not None else None, _record(host, fingerprint)))
+                connection.executemany('INSERT INTO fingerprint_domains (fingerprint, domain) VALUES (?, ?)',
+                                       [(cursor.lastrowid, domain) for domain in set(_text(d) for d, _ in fingerprint.hosts)])
+
+
+    def update(self, fingerprints):
+        """ Save fingerprints read from the database (e.g., with a new user-agent after a software update). """
+        connection = self.connection
+        with connection:
+            for fingerprint in fingerprints:
+                ua = _text(fingerprint.user_agent[0]) if fingerprint.user_agent else None
+                connection.execute('UPDATE fingerprints SET user_agent = ?, ua_length = ?, record = ? WHERE id = ?',
+                                   (ua, len(ua) if ua is not None else None,
+                                    _record(fingerprint.db_host, fingerprint), fingerprint.db_id))
+
+
+    def hosts(self):
+        """ Hosts having fingerprints. """
+        return [row[0] for row in self.connection.execute('SELECT DISTINCT host FROM fingerprints')]
+
+
+    def get_host_fingerprints(self, host):
+        """ Fingerprints of a host, None if it has none (see FingerprintManager.get_host_fingerprints) """
+        return self._select('WHERE host = ?', (_text(host),)) or None
+
+
+    def fingerprints(self):
+        """ All the fingerprints, in the order they were stored. """
+        return self._select('', ())
+
+
+    def similarity_candidates(self, fingerprint):
+        """
+            Fingerprints that can be similar to a fingerprint (see DetectionModule.similarity_check)
+
+            Browser fingerprints are only similar with the same user-agents.
+            Background fingerprints reach the threshold only with the same
+            user-agents, or when they contacted all the domains of the
+            fingerprint (i.e., the first one).
+
+            Parameter
+            -------------
+            fingerprint : Fingerprint
+
+            Return
+            -------------
+            result : list of Fingerprint
+        """
+        if not fingerprint.user_agent:
+            return self._select('WHERE label = ?', (fingerprint.label,))
+        ua = _text(fingerprint.user_agent[0])
+        if fingerprint.label != "Background":
+            return self._select('WHERE label = ? AND user_agent = ?', (fingerprint.label, ua))
+        if not fingerprint.hosts:
+            return self._select('WHERE label = ?', (fingerprint.label,))
+        return self._select('WHERE label = ? AND (user_agent = ? OR id IN '
+                            '(SELECT fingerprint FROM fingerprint_domains WHERE domain = ?))',
+                            (fingerprint.label, ua, _text(fingerprint.hosts[0][0])))
+
+
+    def update_candidates(self, fingerprint, threshold):
+        """
+            Fingerprints of which a fingerprint can be an update (see DetectionModule._is_update)
+
+            They have the same label and method, and a user-agent whose length
+            is close enough to the one of the fingerprint for their distance to
+            be below the threshold.
+
+            Parameters
+            -------------
+            fingerprint : Fingerprint
+
+            threshold : float
+                Maximum distance between the user-agents (see DetectionModule._ua_distance).
+
+            Return
+            -------------
+            result : list of Fingerprint
+        """
+        if threshold >= 1:
+            return self._select('WHERE label = ? AND method = ?', (fingerprint.label, fingerprint.method))
+        length = len(_text(fingerprint.user_agent[0]))
+        return self._select('WHERE label = ? AND method = ? AND ua_length BETWEEN ? AND ?',
+                            (fingerprint.label, fingerprint.method, length * (1 - threshold), length / (1 - threshold)))
+
+
+    # Export the fingerprints to a CSV or binary file (see FingerprintManager.write_to_file).
+    def write_to_file(self, filename):
+        manager = FingerprintManager()
+        for fingerprint in self.fingerprints():
+            manager.store(fingerprint.db_host, fingerprint)
+        manager.write_to_file(filename)
+
+
+    def write_fingerprint_to_file(self, filename, fingerprint, host):
+        self.dumps.write_fingerprint_to_file(filename, fingerprint, host)
+
+
+    def flush_files(self):
+        self.dumps.flush_files()
+
+
+    def close_files(self):
+        self.dumps.close_files()
+
+
+    # Import the fingerprints of a CSV or binary file, with the hosts they belong to.
+    def read_from_file(self, filename):
+        if filename.endswith(BINARY_EXTENSION):
+            self.store_many(read_binary_fingerprints(filename))
+            return
+        manager = FingerprintManager()
+        with open(filename, 'rb') as f:
+            self.store_many((row[-1], manager.from_cvs(row)) for row in csv.reader(f))
+
+
+    def _select(self, where, parameters):
+        result = []
+        for db_id, record in self.connection.execute('SELECT id, record FROM fingerprints ' + where + ' ORDER BY id',
+                                                     parameters):
+            host, fingerprint = _decode_block(str(record))[0]
+            fingerprint.db_id = db_id
+            fingerprint.db_host = host
+            result.append(fingerprint)
+        return result
+
+
+def _text(value):
+    # Strings are stored like in the records of the binary format.
+    return value.encode('utf-8') if isinstance(value, unicode) else str(value)
+
+
+def _record(host, fingerprint):
+    # A block of the binary format, without its length.
+    return sqlite3.Binary(_encode_block([(host, fingerprint)])[4:])
@@ -0,0 +1,157 @@
+""" Decoder for the header_values column written by decanter_dump_input.bro.
+
+Bro logs the request headers as a set[string] where every element has the
+form NAME||value. Elements are separated by the set separator (',') and any
+',' inside a value is escaped as '\\x2c'. For example:
+
+    HOST||www.example.com,ACCEPT||text/html\\x2c*/*;q=0.8,DNT||1
+
+is decoded into:
+
+    {'host': 'www.example.com', 'accept': 'text/html,*/*;q=0.8', 'dnt': '1'}
+
+This decoder is shared by DECANTeR and Dumont, and it runs for every row of
+every log, so the common case is handled with a few C-level string
+operations over the whole row instead of Python work per header.
+"""
+import string
+
+SET_SEPARATOR = ','
+NAME_SEPARATOR = '||'
+ESCAPED_SET_SEPARATOR = '\\x2c'
+
+# Bro ASCII logs never contain raw newlines inside a field (they are escaped),
+# so a newline can be used as an internal separator.
+_SPLIT = '\n'
+
+# Name separators are replaced by a character that is not expected in the
+# values, so that a single translate() keeps only the separators of a row, to
+# check that they alternate (see _mark_names). Rows containing it are decoded
+# element by element.
+_NAME_MARK = '\x00'
+_OTHER_CHARACTERS = dict((separator, ''.join(chr(c) for c in range(256) if chr(c) not in (_NAME_MARK, separator)))
+                         for separator in (SET_SEPARATOR, _SPLIT))
+_TO_SPLIT = string.maketrans(_NAME_MARK + SET_SEPARATOR, _SPLIT + _SPLIT)
+
+# Values used by Bro for unset and empty fields.
+_EMPTY_VALUES = frozenset(['-', '(empty)', ''])
+
+# Raw header name -> lowercased and interned header name.
+_header_names = {}
+_MAX_HEADER_NAMES = 4096
+
+
+def _header_name(name):
+    """ Lowercase and intern a raw header name, caching the result. """
+    lowered = name.lower()
+    if type(lowered) is str:
+        lowered = intern(lowered)
+    if len(_header_names) < _MAX_HEADER_NAMES:
+        _header_names[name] = lowered
+    return lowered
+
+
+def parse_header_values(header_values):
+    """ Parse header values from BRO encoding to dictionary.
+
+        Header names are lowercased, escaped commas in the values are restored.
+        Unset, empty and malformed fields are decoded as an empty dictionary.
+
+        Parameters
+        ----------
+        header_values : string, or list of string
+            header value in bro format, or its NAME||value elements as found
+            in JSON logs (str or unicode)
+
+        Returns
+        -------
+        result : dict
+            header value in dict format
+
+        """
+    return dict(header_items(header_values))
+
+
+def header_items(header_values):
+    """ Parse header values from BRO encoding to a list of (name, value) pairs.
+
+        The pairs are in the order of the log, dict(header_items(x)) is equal to
+        parse_header_values(x) and it is built in the same way.
+
+        Parameters
+        ----------
+        header_values : string, or list of string
+            header value in bro format, or its NAME||value elements as found
+            in JSON logs (str or unicode)
+
+        Returns
+        -------
+        result : list of tuple
+            (name, value) pairs
+
+        """
+    if isinstance(header_values, list):
+        return _list_items(header_values)
+    if not header_values or header_values in _EMPTY_VALUES:
+        return []
+
+    # decanter_dump_input.bro writes exactly one name separator per element.
+    marked = _mark_names(header_values, SET_SEPARATOR) if type(header_values) is str else None
+    if marked is None:
+        return _parse_entries(header_values)
+
+    # Turn both separators into newlines and unescape the commas in one sweep
+    # over the row: 'A||1,B||2\x2c3' -> ['A', '1', 'B', '2,3'].
+    return _pairs(marked.translate(_TO_SPLIT).replace(ESCAPED_SET_SEPARATOR, SET_SEPARATOR).split(_SPLIT))
+
+
+def _mark_names(joined, separator):
+    """ Replace the name separators of joined with _NAME_MARK.
+
+        Returns None unless every element (separated by separator) has exactly
+        one name separator.
+    """
+    marked = joined.replace(NAME_SEPARATOR, _NAME_MARK)
+    if marked.translate(None, _OTHER_CHARACTERS[separator]) != _NAME_MARK + (separator + _NAME_MARK) * joined.count(separator):
+        return None
+    return marked
+
+
+def _list_items(entries):
+    """ Decode the NAME||value elements of a JSON log, with the same sweep used for rows. """
+    if not entries:
+        return []
+    joined = _SPLIT.join(entries)
+    if type(joined) is unicode:
+        joined = joined.encode('utf-8')
+    marked = _mark_names(joined, _SPLIT)
+    if marked is None:
+        return _header_list_items([e.encode('utf-8') if type(e) is unicode else e for e in entries])
+    return _pairs(marked.replace(_NAME_MARK, _SPLIT).split(_SPLIT))
+
+
+def _pairs(parts):
+    """ Pair the names and values of a list [name, value, name, value, ...]. """
+    raw_names = parts[0::2]
+    names = map(_header_names.get, raw_names)
+    if None in names:
+        names = [_header_names.get(n) or _header_name(n) for n in raw_names]
+    return zip(names, parts[1::2])
+
+
+def _header_list_items(entries):
+    result = []
+    for entry in entries:
+        name, sep, value = entry.partition(NAME_SEPARATOR)
+        if not sep:
+            return []
+        if NAME_SEPARATOR in value:
+            value = value[:value.index(NAME_SEPARATOR)]
+        result.append((_header_names.get(name) or _header_name(name), value))
+    return result
+
+
+def _parse_entries(header_values):
+    """ Element by element decoding, used for rows that do not fit the fast path. """
+    return [(name, value.replace(ESCAPED_SET_SEPARATOR, SET_SEPARATOR) if ESCAPED_SET_SEPARATOR in value else value)
+            for name, value in _header_list_items(header_values.split(SET_SEPARATOR))]
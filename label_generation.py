@@ -2,7 +2,9 @@ from brothon import bro_log_reader
 import pandas as pd
 import networkx as nx
 from urlparse import urlparse
+import domains
 import editdistance
+from header_decoder import parse_header_values
 
 class ReferrerGraph:
     """
@@ -216,7 +218,7 @@ class ReferrerGraph:
                 return True
             
         if '*/*' in request.header_values.get('accept', ''):
-            stripped_uri = urlparse(request.uri).path.rsplit('.', 1)
+            stripped_uri = request.uri_path.rsplit('.', 1)
             # If there is an extension
             if len(stripped_uri) == 2:
                 for t in types:
@@ -257,8 +259,8 @@ class ReferrerGraph:
         
         # Check if referer is set (ReSurf method)
         elif referrer != '' and host != '':
-            referrer = urlparse(referrer).netloc.split('.')[-self.subdomains:]
-            host     = urlparse(host).path.split('.')[-self.subdomains:]     
+            referrer = self._domain_(request.referer_domain if request.referer_domain is not None else urlparse(referrer).netloc)
+            host     = self._domain_(urlparse(host).path)
                 
             return  referrer == host and abs((request.ts - headNode.ts).total_seconds()) < self.time_threshold
             
@@ -268,15 +270,33 @@ class ReferrerGraph:
             # Favicons should not contain any query containing exfiltrated data
             # Favicons path will request a favicon.ico item
             # Favicons should not have a request body
-            isFavicon = request.method == 'GET' and not urlparse(request.uri).query and urlparse(request.uri).path.endswith('ico') and 'favicon' in urlparse(request.uri).path and request.req_body_len == 0
-            requestHost  = urlparse(request.header_values.get('host', '')).path.split('.')[-self.subdomains:]
-            headHost = urlparse(headNode.header_values.get('host', '')).path.split('.')[-self.subdomains:]
+            isFavicon = request.method == 'GET' and not request.uri_query and request.uri_path.endswith('ico') and 'favicon' in request.uri_path and request.req_body_len == 0
+            requestHost  = self._domain_(urlparse(request.header_values.get('host', '')).path)
+            headHost = self._domain_(urlparse(headNode.header_values.get('host', '')).path)
             
             return requestHost == headHost and isFavicon
         # Other cases
         else:
             return False
     
+    def _domain_(self, hostname):
+        """ Domain of a hostname used to link requests.
+            
+            Parameters
+            ----------
+            hostname : string
+                
+            Returns
+            -------
+            result : string, or list of string
+                Registered domain when a public suffix list is loaded (see
+                domains.normalizer), the last self.subdomains labels otherwise.
+            
+            """
+        if domains.normalizer.suffixes is not None:
+            return domains.normalizer.registered_domain(hostname)
+        return hostname.split('.')[-self.subdomains:]
+    
     def _parseHeaderValues_(self, headerValues):
         """ Parse header values from BRO encoding to dictionary.
         
@@ -291,10 +311,7 @@ class ReferrerGraph:
                 header value in dict format
             
             """
-        if headerValues == '-':
-            return dict()
-        else:       
-            return  dict((x, y) for x, y in list(map(lambda entry: (entry.split('||')[0].lower(), entry.split('||')[1].replace('\\x2c', ',')), headerValues.split(','))))
+        return parse_header_values(headerValues)
         
         
     def __str__(self):
@@ -536,7 +553,7 @@ class LabelGenerator():
         exfiltration_attempts = []
         
         for request in referrerGraph.iter_disconnected_nodes():
-            if  request.method == 'POST' and request.req_body_len > 0 or request.method == 'GET'  and urlparse(request.uri).query:
+            if  request.method == 'POST' and request.req_body_len > 0 or request.method == 'GET'  and request.uri_query:
                     exfiltration_attempts.append(request)
                     
         return exfiltration_attempts
@@ -568,7 +585,7 @@ class LabelGenerator():
         # Create a similarity filter for all nodes
         connections = dict();
         for request in referrerGraph.iter_disconnected_nodes():
-            key = (request.method, urlparse(request.uri).path)
+            key = (request.method, request.uri_path)
             connections.setdefault(key, []).append(request)
         
         # Iterate over all connections
@@ -618,13 +635,13 @@ class LabelGenerator():
                 result.append(request)
                 
         for request in result:
-            key = (request.method, urlparse(request.uri).path)
+            key = (request.method, request.uri_path)
             connections.setdefault(key, []).append(request)
             
         result = []
             
         for key, value in connections.items():
-            parameters = [urlparse(v.uri).query for v in value]
+            parameters = [v.uri_query for v in value]
             
             outgoing_information = len(parameters[0])
             
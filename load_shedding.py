@@ -0,0 +1,71 @@
+class LoadShedder:
+    """
+    Shed part of the low-risk requests in Testing mode, while the analysis is behind the log.
+
+    A request is low-risk when a known browser (a user-agent labelled Browser
+    in training) sends it with GET, without query string and without body:
+    it cannot carry data out of the network, except in its headers. While
+    the backlog exceeds max_backlog, only one in every sample low-risk
+    requests of each host is kept. POST requests, requests with a body or a
+    query string, and the requests of all other applications are always
+    kept, so exfiltration is still detected in time.
+
+    Shed requests are still added to the referrer graph of their cluster, so
+    that the requests referred by them are still linked, but they are not
+    fingerprinted (see HTTPRequest.shed). They are counted per host in shed.
+    """
+
+    def __init__(self, browser_user_agents, max_backlog=10000, sample=10):
+        """
+            Parameters
+            -------------
+            browser_user_agents : set of string
+                User-agents of the known browsers (see Aggregator.browser_user_agents).
+
+            max_backlog : int, default = 10000
+                Number of rows waiting to be analyzed above which requests are shed.
+
+            sample : int, default = 10
+                While shedding, one in every sample low-risk requests of a host is kept.
+        """
+        self.browser_user_agents = browser_user_agents
+        self.max_backlog = max_backlog
+        self.sample = sample
+        # Host -> number of low-risk requests seen while shedding, and of requests shed
+        self.seen = {}
+        self.shed = {}
+
+    def keep(self, request, backlog):
+        """
+            Whether a request is fingerprinted
+
+            Parameters
+            -------------
+            request : HTTPRequest
+
+            backlog : int
+                Number of rows waiting to be analyzed.
+
+            Returns
+            -------------
+            result : boolean
+        """
+        if backlog <= self.max_backlog or not self._low_risk(request):
+            return True
+        host = request.orig_ip
+        seen = self.seen.get(host, 0)
+        self.seen[host] = seen + 1
+        if seen % self.sample == 0:
+            return True
+        self.shed[host] = self.shed.get(host, 0) + 1
+        return False
+
+    def total(self):
+        """ Number of requests shed, for all the hosts. """
+        return sum(self.shed.itervalues())
+
+    def _low_risk(self, request):
+        if request.method != 'GET' or request.req_body_len or request.uri_query:
+            return False
+        header_values = request.header_values
+        return header_values is not None and header_values.get('user-agent') in self.browser_user_agents
@@ -0,0 +1,319 @@
+from __future__ import division
+from array import array
+import datetime
+import hashlib
+import os
+import tempfile
+import numpy as np
+from header_decoder import header_items
+
+# Bump when the layout of the cache files changes, old entries are then ignored.
+CACHE_VERSION = 1
+
+# Rows restored from a cache file are built this many at a time, so that a
+# cache hit streams the log like a parse does.
+LOAD_CHUNK = 4096
+
+# Naive timestamps are stored as microseconds from this date, so that they are
+# restored exactly as the reader produced them (no timezone conversion).
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class CacheError(Exception):
+    """ Raised when rows cannot be stored in the columnar cache format. """
+    pass
+
+
+class ParsedLogCache:
+    """ On-disk cache of parsed Bro logs.
+
+        Parsed rows (with decoded header values) are stored column by column in
+        a NumPy .npz file: numbers and timestamps as arrays, strings as codes
+        into a table of unique strings, header values as (name, value) code
+        pairs per row. Entries are keyed by path, size and modification time of
+        the log (and optionally by the hash of its content), so a log that
+        changes is parsed again.
+    """
+
+    def __init__(self, cache_dir, hash_content=False, header_columns=('header_values',)):
+        """ Parameters
+            ----------
+            cache_dir : string
+                Folder where the cache files are stored. It is created if missing.
+
+            hash_content : boolean, default = False
+                Also key the entries by the SHA-1 of the log content, to detect
+                changes that preserve size and modification time.
+
+            header_columns : tuple of string, default = ('header_values',)
+                Columns in bro header encoding, they are decoded with
+                header_decoder and stored as (name, value) pairs.
+            """
+        self.cache_dir = cache_dir
+        self.hash_content = hash_content
+        self.header_columns = header_columns
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def path(self, filename, variant=''):
+        """ Return the path of the cache file of given log
+
+            Parameters
+            ----------
+            filename : string
+                Path to the Bro log file.
+
+            variant : string, default = ''
+                Identifies how the log was parsed (e.g., the reader used), rows
+                parsed in different ways are cached separately.
+
+            Returns
+            -------
+            result : string
+                Path of the cache file.
+            """
+        stat = os.stat(filename)
+        key = hashlib.sha1()
+        key.update('{}|{}|{}|{}|{}'.format(CACHE_VERSION, os.path.abspath(filename), stat.st_size, stat.st_mtime, variant))
+        if self.hash_content:
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), ''):
+                    key.update(chunk)
+        return os.path.join(self.cache_dir, '{}.{}.npz'.format(os.path.basename(filename), key.hexdigest()[:16]))
+
+    def rows(self, filename, parse, variant=''):
+        """ Iterate over the parsed rows of a log, from the cache if possible
+
+            On a cache miss the rows produced by parse() are decoded and passed
+            through while they are collected in columnar form, and the cache
+            entry is written once all rows have been consumed. Header values are
+            stored in the order of the log, so the dictionaries restored from the
+            cache are built exactly like the ones of header_decoder.
+
+            Parameters
+            ----------
+            filename : string
+                Path to the Bro log file.
+
+            parse : callable
+                Returns an iterable of rows (dict) of the log, with the header
+                columns still in bro encoding.
+
+            variant : string, default = ''
+                See path().
+
+            Returns
+            -------
+            result : generator of dict
+            """
+        path = self.path(filename, variant)
+        if os.path.exists(path):
+            for row in self.load(path):
+                yield row
+            return
+
+        header_columns = self.header_columns
+        columns = ColumnBuilder()
+        for row in parse():
+            for name in header_columns:
+                if name in row:
+                    row[name] = header_items(row[name])
+            if columns is not None:
+                try:
+                    columns.append(row)
+                except CacheError:
+                    # Rows that do not fit the format are simply not cached.
+                    columns = None
+            for name in header_columns:
+                if name in row:
+                    row[name] = dict(row[name])
+            yield row
+        if columns is not None:
+            self.save(path, columns)
+
+    def save(self, path, columns):
+        """ Atomically write the collected columns to path. """
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **columns.arrays())
+            os.rename(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def load(self, path):
+        """ Iterate over the rows stored in a cache file
+
+            Parameters
+            ----------
+            path : string
+                Path of the cache file.
+
+            Returns
+            -------
+            result : generator of dict
+            """
+        with np.load(path) as data:
+            names = [str(n) for n in data['names']]
+            kinds = [str(k) for k in data['kinds']]
+            blob = data['strings.data'].tostring()
+            offsets = data['strings.offsets'].tolist()
+            ints = data['ints']
+            floats = data['floats']
+            headers = [(data['headers{}.indptr'.format(i)], data['headers{}.pairs'.format(i)])
+                       for i in xrange(kinds.count('headers'))]
+
+        strings = [blob[offsets[i]:offsets[i + 1]] for i in xrange(len(offsets) - 1)]
+
+        # The columns stay in their arrays, rows are built LOAD_CHUNK at a time.
+        length = ints.shape[1]
+        for start in xrange(0, length, LOAD_CHUNK):
+            end = min(start + LOAD_CHUNK, length)
+            int_columns = iter(ints[:, start:end].tolist())
+            float_columns = iter(floats[:, start:end].tolist())
+            header_columns = iter(headers)
+            columns = []
+            for kind in kinds:
+                if kind == 'headers':
+                    indptr, pairs = next(header_columns)
+                    bounds = indptr[start:end + 1].tolist()
+                    first = bounds[0]
+                    name_codes, value_codes = pairs[:, first:bounds[-1]].tolist()
+                    chunk = zip([strings[c] for c in name_codes], [strings[c] for c in value_codes])
+                    columns.append([dict(chunk[s - first:e - first]) for s, e in zip(bounds, bounds[1:])])
+                elif kind == 'float':
+                    columns.append(next(float_columns))
+                else:
+                    values = next(int_columns)
+                    if kind == 'str':
+                        columns.append([strings[c] for c in values])
+                    elif kind == 'time':
+                        columns.append([EPOCH + datetime.timedelta(microseconds=v) for v in values])
+                    elif kind == 'bool':
+                        columns.append([bool(v) for v in values])
+                    else:
+                        columns.append(values)
+
+            for values in zip(*columns):
+                yield dict(zip(names, values))
+
+
+class ColumnBuilder:
+    """ Collects parsed rows column by column, interning the strings.
+
+        All strings (string columns, header names and values) share one table,
+        integer-like columns (string codes, counts, timestamps) are stacked in a
+        single 2-D array and so are the float columns, to keep the number of
+        arrays, and so the cost of opening the .npz, low.
+    """
+
+    def __init__(self):
+        self.names = None
+        self.kinds = None
+        self.columns = None
+        self.strings = StringTable()
+        self.length = 0
+
+    def append(self, row):
+        if self.names is None:
+            self.names = sorted(row.keys())
+            self.kinds = [_kind(row[name]) for name in self.names]
+            self.columns = [_new_column(kind) for kind in self.kinds]
+        elif len(row) != len(self.names):
+            raise CacheError('Rows with different columns cannot be cached.')
+
+        code = self.strings.code
+        for name, kind, column in zip(self.names, self.kinds, self.columns):
+            if name not in row:
+                raise CacheError('Rows with different columns cannot be cached.')
+            value = row[name]
+            if _kind(value) != kind:
+                raise CacheError('Column {} mixes values of type {} and {}.'.format(name, kind, _kind(value)))
+            if kind == 'headers':
+                indptr, name_codes, value_codes = column
+                for header_name, header_value in value:
+                    name_codes.append(code(header_name))
+                    value_codes.append(code(header_value))
+                indptr.append(len(name_codes))
+            elif kind == 'str':
+                column.append(code(value))
+            elif kind == 'time':
+                column.append(_microseconds(value - EPOCH))
+            else:
+                column.append(value)
+        self.length += 1
+
+    def arrays(self):
+        """ Return the collected columns as a dict of NumPy arrays. """
+        kinds = self.kinds or []
+        columns = self.columns or []
+        data, offsets = self.strings.arrays()
+        result = {
+            'names': np.array(self.names or []),
+            'kinds': np.array(kinds),
+            'strings.data': data,
+            'strings.offsets': offsets,
+            'ints': _stack([c for k, c in zip(kinds, columns) if k not in ('headers', 'float')], np.int64, self.length),
+            'floats': _stack([c for k, c in zip(kinds, columns) if k == 'float'], np.float64, self.length),
+        }
+        headers = [c for k, c in zip(kinds, columns) if k == 'headers']
+        for i, (indptr, name_codes, value_codes) in enumerate(headers):
+            result['headers{}.indptr'.format(i)] = np.array(indptr, dtype=np.int64)
+            result['headers{}.pairs'.format(i)] = np.array([name_codes, value_codes], dtype=np.int64).reshape(2, -1)
+        return result
+
+
+class StringTable:
+    """ Table of unique strings, each identified by an integer code. """
+
+    def __init__(self):
+        self.codes = {}
+        self.strings = []
+
+    def code(self, string):
+        code = self.codes.get(string)
+        if code is None:
+            code = self.codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+    def arrays(self):
+        """ Return the concatenated strings and the offset of each of them. """
+        offsets = array('l', [0])
+        for s in self.strings:
+            offsets.append(offsets[-1] + len(s))
+        return np.array(bytearray(''.join(self.strings)), dtype=np.uint8), np.array(offsets, dtype=np.int64)
+
+
+def _kind(value):
+    if isinstance(value, list):
+        return 'headers'
+    if isinstance(value, str):
+        return 'str'
+    if isinstance(value, datetime.datetime):
+        return 'time'
+    if isinstance(value, (bool, np.bool_)):
+        return 'bool'
+    if isinstance(value, (int, long, np.integer)):
+        return 'int'
+    if isinstance(value, (float, np.floating)):
+        return 'float'
+    raise CacheError('Values of type {} cannot be cached.'.format(type(value).__name__))
+
+
+def _new_column(kind):
+    if kind == 'headers':
+        return (array('l', [0]), array('l'), array('l'))
+    if kind == 'float':
+        return array('d')
+    return array('l')
+
+
+def _stack(columns, dtype, length):
+    return np.array(columns, dtype=dtype).reshape(len(columns), length)
+
+
+def _microseconds(delta):
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
@@ -0,0 +1,212 @@
+from __future__ import division
+import errno
+import io
+import os
+import time
+from bro_reader import MappedBroLog, JsonBroLog, DECANTER_FIELDS, json
+
+
+class LogFollower:
+    """ Follow a Bro log file while Bro is writing it, like tail -F.
+
+        New rows are yielded as soon as they are complete. The file is watched
+        by polling: when Bro rotates the log (the path then refers to a new
+        file) the old file is read until its end and the new one is read from
+        its start, when the log is truncated it is read again from its start.
+        ASCII headers are parsed whenever they appear, so every rotated file can
+        have its own header. JSON logs are supported as well.
+
+        While no new rows are written, None is yielded every poll_interval
+        seconds, so that the consumer can keep track of time.
+
+        The position of the last line yielded is kept in self.position, so
+        that a follower started again with it (e.g., from a checkpoint)
+        continues with the next line.
+    """
+
+    def __init__(self, filename, fields=DECANTER_FIELDS, poll_interval=1.0, from_start=False, block_size=1 << 16, position=None):
+        """ Parameters
+            ----------
+            filename : string
+                Path to the Bro log file, it does not need to exist yet.
+
+            fields : iterable of string, default = DECANTER_FIELDS
+                Columns to decode. Use None to decode all the columns.
+
+            poll_interval : float, default = 1.0
+                Seconds between two checks for new data.
+
+            from_start : boolean, default = False
+                Read the rows already in the log. By default only the header of
+                the log is read, and the rows written from now on are yielded.
+
+            block_size : int, default = 64KB
+                Amount of data read at once.
+
+            position : (int, int), default = None
+                Inode and offset of the log saved from self.position. If the
+                log is still the same file, it is read from the offset. If it
+                was rotated meanwhile, the new log is read from its start.
+
+            """
+        self.filename = filename
+        self.fields = fields
+        self.poll_interval = poll_interval
+        self.from_start = from_start
+        self.block_size = block_size
+        # (inode, offset) of the end of the last line yielded.
+        self.position = position
+        self.rotations = 0
+        self.truncations = 0
+        self.stopped = False
+
+    def stop(self):
+        """ Stop following the log, readrows() returns at the next poll. """
+        self.stopped = True
+
+    def readrows(self):
+        """ Iterate over the rows written to the log
+
+            Returns
+            -------
+            result : generator of dict, or None
+                One dictionary per row, containing the requested columns, and
+                None when no new row was written in the last poll_interval
+                seconds.
+
+            """
+        convert_json = JsonBroLog(self.filename, self.fields)._converter()
+        log = None
+        columns = None
+        for line in self.lines():
+            if line is None:
+                yield None
+            elif not line:
+                continue
+            elif line[0] == '{':
+                yield convert_json(json.loads(line))
+            elif line[0] == '#':
+                # Every (rotated) log file starts with its own header.
+                if line.startswith('#separator'):
+                    log = MappedBroLog(self.filename, self.fields)
+                    columns = None
+                if log is not None:
+                    log._parse_header_line(line)
+                    if line.startswith('#types'):
+                        columns = log._columns()
+                        needed = max(index for _, index, _, _ in columns) + 1 if columns else 0
+            elif columns:
+                values = line.split(log.separator, needed)
+                if len(values) < needed:
+                    continue
+                row = {}
+                for name, index, converter, unset in columns:
+                    value = values[index]
+                    if value == log.unset_field:
+                        row[name] = unset
+                    elif converter is None:
+                        row[name] = value
+                    else:
+                        row[name] = converter(value)
+                yield row
+
+    def lines(self):
+        """ Iterate over the lines written to the log
+
+            Returns
+            -------
+            result : generator of string, or None
+                Complete lines without the trailing newline, and None when no
+                new line was written in the last poll_interval seconds.
+
+            """
+        f = self._wait_open()
+        if f is None:
+            return
+        rest = ''
+        inode = os.fstat(f.fileno()).st_ino
+        try:
+            if self.position is not None:
+                # Resume: the header is parsed again, then the lines after the saved position are read.
+                saved_inode, offset = self.position
+                if saved_inode == inode and offset <= os.fstat(f.fileno()).st_size:
+                    for line in self._header(f):
+                        yield line
+                    f.seek(offset)
+            elif not self.from_start:
+                for line in self._header(f):
+                    yield line
+                # Start at the end of the log. If its last line is incomplete
+                # the part read from now on is not a line, drop it.
+                end = os.fstat(f.fileno()).st_size
+                f.seek(max(end - 1, 0))
+                if end and f.read(1) != '\n':
+                    rest = None
+            while not self.stopped:
+                data = f.read(self.block_size)
+                if data:
+                    if rest is None:
+                        if '\n' not in data:
+                            continue
+                        data = data[data.index('\n') + 1:]
+                        rest = ''
+                    offset = f.tell() - len(data) - len(rest)
+                    lines = (rest + data).split('\n')
+                    rest = lines.pop()
+                    for line in lines:
+                        offset += len(line) + 1
+                        self.position = (inode, offset)
+                        yield line
+                    continue
+
+                # End of the file: check whether it was rotated or truncated.
+                current = _stat(self.filename)
+                if current is not None and current.st_ino != os.fstat(f.fileno()).st_ino:
+                    # Rotated, the old file has been read until its end.
+                    if rest:
+                        yield rest
+                    rest = ''
+                    f.close()
+                    f = io.open(self.filename, 'rb')
+                    inode = os.fstat(f.fileno()).st_ino
+                    self.rotations += 1
+                    continue
+                if current is not None and current.st_size < f.tell():
+                    # Truncated, the partial line belonged to the old content.
+                    f.seek(0)
+                    rest = ''
+                    self.truncations += 1
+                    continue
+
+                yield None
+                time.sleep(self.poll_interval)
+        finally:
+            f.close()
+
+    def _wait_open(self):
+        """ Open the log, waiting for Bro to create it. """
+        while not self.stopped:
+            try:
+                return io.open(self.filename, 'rb')
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            time.sleep(self.poll_interval)
+        return None
+
+    def _header(self, f):
+        """ Yield the header lines of an ASCII log. """
+        for line in f:
+            if not line.startswith('#'):
+                return
+            yield line.rstrip('\n')
+            if line.startswith('#types'):
+                return
+
+
+def _stat(filename):
+    try:
+        return os.stat(filename)
+    except OSError:
+        # Between the rotation and the next write the log does not exist.
+        return None
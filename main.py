@@ -1,13 +1,25 @@
 from bro_parser import BroParser
-from decanter_new import Aggregator
+from bro_reader import SensorMerger
+from decanter_new import Aggregator, CheckpointError
+from sharding import ShardedAggregator
+from pipeline import Pipeline, QUEUE_SIZE, BATCH_SIZE
+from load_shedding import LoadShedder
 from evaluation_utils import EvaluationUtils
 from detection import OfflineDetector
+from fingerprint import BINARY_EXTENSION
+from fingerprint_db import FingerprintDatabase
+import domains
+import datetime
+import os
 import sys
 import argparse
 
+# Maximum delay (seconds) of a row in a sensor log with respect to the rows before it.
+MERGE_SLACK = 60
 
-def dumped_fingerprint_analysis(path):
-    o = OfflineDetector(path)
+
+def dumped_fingerprint_analysis(path, database=None):
+    o = OfflineDetector(path, database)
 
     # Run detection on the loaded CSV files in path.
     # Files with filename having the string "training" are used for training.
@@ -27,26 +39,117 @@ def dumped_fingerprint_analysis(path):
         print f
 
 
-def log_fingerprint_analysis(training_log, testing_log, offline):
-    bp = BroParser()
-    training = bp.parseFile(training_log)
-    testing = bp.parseFile(testing_log)
+def read_logs(bp, logs, workers=1, merge=False):
+    # Logs of different sensors are merged by time, requests seen by more than one sensor are kept once.
+    if merge and len(logs) > 1:
+        return SensorMerger([bp.iterFile(l) for l in logs], slack=MERGE_SLACK)
+    # Logs are streamed row by row into the aggregator, they are never loaded in memory at once.
+    if workers <= 1:
+        return bp.iterFile(logs)
+    # With several workers, whole files are parsed in parallel and then streamed in order.
+    return (row for _, rows in bp.iterFiles(logs, workers) for row in rows)
+
+
+def print_pipeline(p):
+    print "Pipeline stages:"
+    for stats in p.stats:
+        print "    {}".format(stats)
+    if p.shedder is not None:
+        print "Shed requests: {}".format(p.shedder.total())
+        for host, count in sorted(p.shedder.shed.iteritems()):
+            print "    {}: {}".format(host, count)
+
+
+def print_alert(fingerprint):
+    print """
+    Alert:
+    """
+    print fingerprint
+    sys.stdout.flush()
+
+
+def log_fingerprint_analysis(training_log, testing_log, offline, reader='brothon', cache_dir=None, workers=1, merge=False, follow=False, shards=1, window='global', early_fire=False, checkpoint=None, limits=None, pipeline=False, shed=None, shed_sample=10, dump_format='csv', database=None, bounded_outgoing=False):
+    limits = limits or {}
+    bp = BroParser(reader, cache_dir)
     
-    # Initialize the aggregator.
-    # Use Training mode first (i.e., 0)
-    # Use offline value passed from the user for offline or online analysis.
-    decanter_trainer = Aggregator(0, offline)
+    # Offline dumps are written in CSV, or in the binary format that is faster to load.
+    extension = BINARY_EXTENSION if dump_format == 'binary' else '.csv'
+    settings = dict(offline=offline, dump_testing='testing_fingerprints' + extension,
+                    dump_training='training_fingerprints' + extension, window=window, early_fire=early_fire,
+                    fingerprint_db=database, bounded_outgoing=bounded_outgoing, **limits)
     
-    # Fingerprint training based on training_log
-    decanter_trainer.analyze_log(training)
-
-    # Aggregator switches mode from training to testing (0 --> 1).
-    decanter_trainer.change_mode(1)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        # Resume from the saved state: no training, open windows are continued.
+        # The options must be the ones the state was saved with.
+        decanter_trainer = Aggregator.load_checkpoint(checkpoint, **settings)
+        print "Aggregator restored from {}.".format(checkpoint)
+    else:
+        training = read_logs(bp, training_log, workers, merge)
+        
+        # Initialize the aggregator.
+        # Use Training mode first (i.e., 0)
+        # Use offline value passed from the user for offline or online analysis.
+        decanter_trainer = Aggregator(0, **settings)
+        
+        # Fingerprint training based on training_log
+        if pipeline:
+            # Reading, aggregation and detection run concurrently, the statistics of each stage are printed at the end.
+            p = Pipeline(decanter_trainer)
+            p.analyze_log(training)
+            print_pipeline(p)
+        else:
+            decanter_trainer.analyze_log(training)
+
+        # Aggregator switches mode from training to testing (0 --> 1).
+        decanter_trainer.change_mode(1)
+        
+        if checkpoint is not None:
+            decanter_trainer.save_checkpoint(checkpoint)
 
     # Extract Fingerprints from testing_log
     # If online (i.e., 0), Fingerprints are tested against trained Fingerprints
     # If offline (i.e., 1), testing and training fingerprints are dumped in seperate csv files.
-    decanter_trainer.analyze_log(testing)
+    if follow:
+        # Follow the log Bro is writing, alerts are printed as soon as a time window is closed.
+        decanter_trainer.on_alert = print_alert
+    
+    # Online testing can be split among several processes, each testing the requests of part of the hosts.
+    tester = decanter_trainer
+    sharded = shards > 1 and offline == 0
+    if sharded:
+        tester = ShardedAggregator(decanter_trainer, shards)
+    elif pipeline or shed is not None:
+        # Under load, part of the low-risk requests of known browsers are not fingerprinted.
+        shedder = LoadShedder(decanter_trainer.browser_user_agents, shed, shed_sample) if shed is not None else None
+        tester = Pipeline(decanter_trainer, shedder=shedder)
+    
+    if follow:
+        # A restored analysis continues after the last row read from the same log.
+        position = None
+        if decanter_trainer.log_position is not None and decanter_trainer.log_position[0] == testing_log[0]:
+            position = decanter_trainer.log_position[1]
+        try:
+            tester.follow(bp.followFile(testing_log[0], position=position))
+        except KeyboardInterrupt:
+            # With a checkpoint, the open windows are saved instead, and resumed at the next start.
+            if sharded:
+                tester.flush()
+            elif checkpoint is None:
+                decanter_trainer.flush()
+        if sharded:
+            tester.close()
+        else:
+            decanter_trainer.close_dumps()
+        if bp.follower is not None:
+            decanter_trainer.log_position = (testing_log[0], bp.follower.position)
+    else:
+        tester.analyze_log(read_logs(bp, testing_log, workers, merge))
+    
+    if isinstance(tester, Pipeline):
+        print_pipeline(tester)
+    
+    if checkpoint is not None:
+        decanter_trainer.save_checkpoint(checkpoint)
     
     e = EvaluationUtils(decanter_trainer.alerts, [])
     e._unique_fingerprints()
@@ -56,22 +159,73 @@ def log_fingerprint_analysis(training_log, testing_log, offline):
     """.format(len(e.unique_fing))
     for f in e.unique_fing:
         print f
+    
+    if decanter_trainer.evicted_clusters or decanter_trainer.evicted_graphs:
+        print """
+    Evicted clusters: {}
+    Evicted referrer graphs: {}
+    """.format(decanter_trainer.evicted_clusters, decanter_trainer.evicted_graphs)
 
 
 def main(argv):
     parser = argparse.ArgumentParser(description="DECANTeR: DETection of Anomalous outbouNd HTTP Traffic by Passive Application Fingerprinting")
-    parser.add_argument('--csv', type=str, help='Run the evaluation loading Fingerprints from csv files stored in the selected folder. CSV files containing "training" in the filename will be used to train the fingerprints. CSV files having "testing" in the filename will be used for testing.') 
-    parser.add_argument('-t', '--training', type=str, help='Bro log file used to train fingerprints.')
-    parser.add_argument('-T', '--testing', type=str, help='Bro log file used for testing against trained fingerprints.')
+    parser.add_argument('--csv', type=str, help='Run the evaluation loading Fingerprints from csv (and binary .fpb) files stored in the selected folder. CSV files containing "training" in the filename will be used to train the fingerprints. CSV files having "testing" in the filename will be used for testing.') 
+    parser.add_argument('--dump-format', type=str, default='csv', choices=['csv', 'binary'], help='Format of the fingerprints dumped with -o 1. "binary" files (.fpb) are smaller and much faster to load with --csv. (default=csv).')
+    parser.add_argument('-t', '--training', type=str, nargs='+', help='Bro log file used to train fingerprints. Several files or glob patterns (e.g., "logs/decanter.*.log.gz") are read one after the other. Files may be compressed with gzip, bzip2 or xz.')
+    parser.add_argument('-T', '--testing', type=str, nargs='+', help='Bro log file used for testing against trained fingerprints. Accepts several files, glob patterns and compressed files like --training.')
     parser.add_argument('-o', '--offline', type=int, default=1, help='Choose 1 if you want to dump the fingerprints extracted from the logs to .csv files. Choose 0 if you want to run the evaluation from the logs. (default=1).') 
-
+    parser.add_argument('--reader', type=str, default='brothon', choices=BroParser.readers, help='Reader used for Bro log files. "mmap" memory-maps the logs and only decodes the columns used by DECANTeR. (default=brothon).')
+    parser.add_argument('--cache', type=str, default=None, help='Folder where parsed Bro logs are cached, so that logs already parsed in previous runs are not parsed again.')
+    parser.add_argument('-m', '--merge', action='store_true', help='Every file (or glob pattern) given for training and testing is the log of a different sensor: logs are merged by time and requests logged by more than one sensor are analyzed once. Log files are not parsed in parallel in this mode.')
+    parser.add_argument('-f', '--follow', action='store_true', help='Follow the testing log while Bro is writing it (like tail -F, log rotation included) and print the alerts as soon as they are raised. Stop with Ctrl-C.')
+    parser.add_argument('--window', type=str, default='global', choices=Aggregator.windows, help='Time windows of testing. "global": the requests of all hosts are fingerprinted together every 10 minutes. "cluster": the requests of every host and user-agent are fingerprinted 10 minutes after the first of them. (default=global).')
+    parser.add_argument('-e', '--early', action='store_true', help='Test the requests of non-browser applications as soon as they send more than the outgoing information threshold, instead of waiting for the end of the time window. Only used with -o 0.')
+    parser.add_argument('-b', '--bounded-outgoing', action='store_true', help='Stop computing the outgoing information of a fingerprint once it exceeds the detection threshold. Alerts are the same, but the outgoing information printed for them is a lower bound. Only used with -o 0.')
+    parser.add_argument('-s', '--shards', type=int, default=1, help='Number of processes testing the requests in parallel, each one the requests of part of the hosts (source IPs). Only used with -o 0, requires --window global and cannot be combined with --pipeline or --shed. (default=1).')
+    parser.add_argument('--max-clusters', type=int, default=None, help='Maximum number of (host, user-agent) clusters kept in memory. When exceeded, the least recently used cluster is fingerprinted before the end of its time window. With --shards, each shard keeps its share of the clusters.')
+    parser.add_argument('--max-graphs', type=int, default=None, help='Maximum number of referrer graphs (one per user-agent) kept between time windows. When exceeded, the least recently updated graph is dropped. With --shards, each shard keeps its share of the graphs.')
+    parser.add_argument('--graph-idle', type=int, default=None, help='Minutes after which the referrer graph of a user-agent that is not seen anymore is dropped.')
+    parser.add_argument('-p', '--pipeline', action='store_true', help='Read the logs, aggregate the requests and test the fingerprints in concurrent stages, and print the throughput of each stage. Cannot be combined with --shards.')
+    parser.add_argument('--shed', type=int, default=None, help='Number of rows waiting to be analyzed (with --pipeline) above which only one in --shed-sample GET requests of known browsers, without query string nor body, is fingerprinted. The others are only added to the referrer graphs. At most {} rows wait in the pipeline, so the value must be lower. When testing a file (instead of --follow) the reader always keeps the pipeline full, so shedding is on for the whole run. The requests shed per host are printed at the end.'.format(QUEUE_SIZE * BATCH_SIZE))
+    parser.add_argument('--shed-sample', type=int, default=10, help='With --shed, one in this number of low-risk requests of each host is fingerprinted. (default=10).')
+    parser.add_argument('--db', type=str, default=None, help='SQLite database file where the trained fingerprints are stored, instead of memory. With --csv, the training files are loaded in it, unless it already holds fingerprints. With --training, it must not hold fingerprints yet. Testing writes to it: trained fingerprints matched by a software update are saved with the new user-agent.')
+    parser.add_argument('--public-suffix-list', type=str, default=None, help='Public suffix list file (e.g., public_suffix_list.dat from https://publicsuffix.org) used to extract the registered domain of hostnames (www.bbc.co.uk ---> bbc.co.uk). By default the last two labels are used (www.bbc.co.uk ---> co.uk).')
+    parser.add_argument('-c', '--checkpoint', type=str, default=None, help='File where the state of DECANTeR is saved after training and at exit. If it exists, the state is restored from it instead of training again, and --training is not needed.')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of processes parsing the log files in parallel, when several files are given for training or testing. (default=1).')
 
     args = parser.parse_args()
+    if args.shed != None and args.shed >= QUEUE_SIZE * BATCH_SIZE:
+        parser.error('--shed must be lower than {}, the number of rows the pipeline can hold'.format(QUEUE_SIZE * BATCH_SIZE))
+    if args.shed_sample < 1:
+        parser.error('--shed-sample must be at least 1')
+    if args.shards > 1 and args.offline == 0:
+        # Shards test the requests in their own processes, with global time windows only.
+        if args.window != 'global':
+            parser.error('--shards requires --window global')
+        if args.pipeline or args.shed != None:
+            parser.error('--shards cannot be combined with --pipeline or --shed')
+    restore = args.checkpoint != None and os.path.exists(args.checkpoint)
+    if args.db != None and args.training != None and not restore and os.path.exists(args.db):
+        # Fingerprints trained from the logs would be added to the ones of another training.
+        if len(FingerprintDatabase(args.db)) > 0:
+            parser.error('{} already holds fingerprints, remove it to train from --training'.format(args.db))
+    if args.public_suffix_list != None:
+        domains.normalizer.load(args.public_suffix_list)
     if args.csv != None:
-        dumped_fingerprint_analysis(args.csv)
-
-    if args.training != None and args.testing != None and (args.offline != None):
-        log_fingerprint_analysis(args.training, args.testing, args.offline)
+        dumped_fingerprint_analysis(args.csv, args.db)
+
+    limits = {'max_clusters': args.max_clusters, 'max_graphs': args.max_graphs,
+              'graph_idle': datetime.timedelta(minutes=args.graph_idle) if args.graph_idle != None else None}
+    if (args.training != None or restore) and args.testing != None and (args.offline != None):
+        try:
+            log_fingerprint_analysis(args.training, args.testing, args.offline, reader=args.reader, cache_dir=args.cache,
+                                     workers=args.workers, merge=args.merge, follow=args.follow, shards=args.shards,
+                                     window=args.window, early_fire=args.early, checkpoint=args.checkpoint, limits=limits,
+                                     pipeline=args.pipeline, shed=args.shed, shed_sample=args.shed_sample,
+                                     dump_format=args.dump_format,
+                                     database=args.db, bounded_outgoing=args.bounded_outgoing)
+        except CheckpointError as e:
+            parser.error(str(e))
     
 
 if __name__ == "__main__":
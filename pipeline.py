@@ -0,0 +1,276 @@
+import Queue
+import datetime
+import sys
+import threading
+import time
+from decanter_new import HTTPRequest, _rows
+
+_END = object()
+
+# Default number of batches waiting in each queue, and of rows per batch. The backlog given to a
+# LoadShedder is at most QUEUE_SIZE * BATCH_SIZE rows.
+QUEUE_SIZE = 64
+BATCH_SIZE = 256
+
+
+class StageStats(object):
+    """ Counters of a stage of the Pipeline. """
+
+    def __init__(self, name):
+        self.name = name
+        # Items processed (rows, or clusters for the detection stage)
+        self.items = 0
+        # Seconds spent working, and waiting for the next stage (back-pressure)
+        self.busy = 0.0
+        self.blocked = 0.0
+        # Largest number of items waiting in the input queue of the stage
+        self.max_depth = 0
+
+    def __str__(self):
+        rate = self.items / self.busy if self.busy else 0.0
+        return '{:<11} {:>9} items {:>10.0f}/s busy {:>8.2f}s blocked {:>8.2f}s max queue {:>4}'.format(
+            self.name, self.items, rate, self.busy, self.blocked, self.max_depth)
+
+
+class Pipeline:
+    """
+    Run an Aggregator as three stages connected by bounded queues.
+
+    - reader: a thread reading and parsing the rows of the log, in batches;
+    - aggregator: the calling thread, building the HTTP requests and
+      aggregating them in clusters, and closing the time windows;
+    - detection: a thread labelling, fingerprinting and testing the closed
+      clusters, in the order in which they were closed.
+
+    When a stage is faster than the next one it waits for it (the queues are
+    bounded), so memory stays bounded. Reading (and decompression, which
+    releases the GIL) overlaps with aggregation and detection. Clusters are
+    processed in order by a single detection thread, so the results are the
+    same as with the Aggregator alone: the referrer graph of a user-agent
+    depends on its previous windows. Use sharding.ShardedAggregator to spread
+    detection over several processes.
+
+    In Testing mode, a LoadShedder can shed low-risk requests (they are
+    not fingerprinted) while the aggregator stage is behind the reader.
+
+    The counters of each stage are in stats after the analysis.
+    """
+
+    # Seconds after which a batch of rows is passed on even if it is not full, when following a log.
+    max_batch_delay = 0.5
+
+    def __init__(self, aggregator, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, shedder=None):
+        """
+            Parameters
+            -------------
+            aggregator : Aggregator
+
+            queue_size : int, default = 64
+                Maximum number of batches of rows, and of clusters, waiting in
+                each queue.
+
+            batch_size : int, default = 256
+                Rows passed at once from the reader to the aggregator.
+
+            shedder : load_shedding.LoadShedder, default = None
+                Policy shedding requests in Testing mode, the backlog it is
+                given is the number of rows waiting in the queue of the
+                aggregator stage, at most queue_size * batch_size rows. No
+                request is shed when None.
+        """
+        self.aggregator = aggregator
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.shedder = shedder
+        self.stats = []
+
+
+    def analyze_log(self, data):
+        """
+            Analyze a Dataframe or a stream of rows, in the mode of the Aggregator (see Aggregator.analyze_log)
+
+            Parameter
+            -------------
+            data : pandas Dataframe, or iterable of dict
+        """
+        self._run(data, follow=False)
+
+
+    def follow(self, data):
+        """
+            Analyze an unbounded stream of rows in Testing mode (see Aggregator.follow)
+
+            Parameter
+            -------------
+            data : iterable of dict, or None
+        """
+        if self.aggregator.mode != 1:
+            raise ValueError('Following a log is only possible in Testing mode.')
+        self._run(data, follow=True)
+
+
+    def _run(self, data, follow):
+        aggregator = self.aggregator
+        reader, aggregation, detection = self.stats = [StageStats('reader'), StageStats('aggregator'), StageStats('detection')]
+        self.stop = threading.Event()
+        self.failure = None
+        rows = Queue.Queue(self.queue_size)
+        clusters = Queue.Queue(self.queue_size)
+        if follow:
+            data, max_delay = data, self.max_batch_delay
+        else:
+            data, max_delay = _rows(data), None
+        threads = [threading.Thread(target=self._read, args=(data, rows, reader, max_delay)),
+                   threading.Thread(target=self._detect, args=(clusters, detection))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        aggregator.on_cluster = lambda host, cluster, early_methods: self._put(clusters, (host, cluster, early_methods), aggregation)
+        try:
+            self._aggregate(rows, aggregation, follow)
+            if aggregator.mode == 0:
+                aggregator._finish_training()
+            else:
+                aggregator.flush()
+            self._put(clusters, _END, aggregation)
+            threads[1].join()
+            self._check_failure()
+            if aggregator.mode == 0:
+                aggregator._dump_training()
+        except KeyboardInterrupt:
+            # Stop reading, but test the clusters that were already closed.
+            self.stop.set()
+            for t in threads:
+                t.join()
+            while not clusters.empty():
+                item = clusters.get_nowait()
+                if item is not _END:
+                    aggregator._create_fingerprints(*item)
+            raise
+        finally:
+            aggregator.on_cluster = None
+            self.stop.set()
+            for t in threads:
+                t.join()
+            aggregator.close_dumps()
+
+
+    def _read(self, data, rows, stats, max_delay):
+        """
+            Reader stage: parse the rows, in batches.
+            
+            None (no new row in a followed log) is passed on as is, and with
+            max_delay a batch is passed on after max_delay seconds even if it
+            is not full.
+        """
+        try:
+            batch = []
+            start = time.time()
+            for row in data:
+                if self.stop.is_set():
+                    return
+                if row is None:
+                    stats.busy += time.time() - start
+                    stats.items += len(batch)
+                    if batch:
+                        self._put(rows, batch, stats)
+                    self._put(rows, None, stats)
+                    batch = []
+                    start = time.time()
+                    continue
+                batch.append(row)
+                if len(batch) == self.batch_size or (max_delay is not None and time.time() - start > max_delay):
+                    stats.busy += time.time() - start
+                    stats.items += len(batch)
+                    self._put(rows, batch, stats)
+                    batch = []
+                    start = time.time()
+            stats.busy += time.time() - start
+            stats.items += len(batch)
+            if batch:
+                self._put(rows, batch, stats)
+            self._put(rows, _END, stats)
+        except Exception:
+            self._put(rows, sys.exc_info(), stats)
+
+
+    def _aggregate(self, rows, stats, follow):
+        """ Aggregator stage: aggregate the HTTP requests, closing the time windows. """
+        aggregator = self.aggregator
+        insert = aggregator._insert_http_request if aggregator.mode == 0 else aggregator._test_request
+        shedder = self.shedder if aggregator.mode == 1 else None
+        last_ts = None
+        while True:
+            batch = self._get(rows, stats)
+            if batch is _END:
+                return
+            if batch is None:
+                # No new row in the followed log, advance the time with the wall clock.
+                if last_ts is not None and aggregator.time_start is not None:
+                    aggregator.advance_time(last_ts + datetime.timedelta(seconds=time.time() - last_seen))
+                continue
+            if isinstance(batch, tuple):
+                # The reader failed, raise its exception here.
+                raise batch[0], batch[1], batch[2]
+            start, blocked = time.time(), stats.blocked
+            if shedder is not None:
+                backlog = rows.qsize() * self.batch_size
+            for row in batch:
+                h = HTTPRequest(row)
+                if shedder is not None and not shedder.keep(h, backlog):
+                    # Still aggregated, for the referrer graph of its cluster.
+                    h.shed = True
+                insert(h)
+            if follow and batch:
+                last_ts, last_seen = h.ts, time.time()
+            stats.busy += time.time() - start - (stats.blocked - blocked)
+            stats.items += len(batch)
+            self._check_failure()
+
+
+    def _detect(self, clusters, stats):
+        """ Detection stage: create (and test) the fingerprints of the closed clusters. """
+        while True:
+            item = self._get(clusters, stats)
+            if item is _END:
+                return
+            if self.failure is not None:
+                # Keep reading, so that the aggregator is never blocked.
+                continue
+            start = time.time()
+            try:
+                self.aggregator._create_fingerprints(*item)
+            except Exception:
+                self.failure = sys.exc_info()
+            stats.busy += time.time() - start
+            stats.items += 1
+
+
+    def _check_failure(self):
+        if self.failure is not None:
+            failure, self.failure = self.failure, None
+            raise failure[0], failure[1], failure[2]
+
+
+    def _put(self, queue, item, stats):
+        """ Put an item in the queue of the next stage, waiting while it is full. """
+        start = time.time()
+        while not self.stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                break
+            except Queue.Full:
+                pass
+        stats.blocked += time.time() - start
+
+
+    def _get(self, queue, stats):
+        """ Get the next item of the queue of a stage, _END when the pipeline is stopped. """
+        stats.max_depth = max(stats.max_depth, queue.qsize())
+        while not self.stop.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        return _END
@@ -0,0 +1,247 @@
+import datetime
+import multiprocessing
+import signal
+import time
+import traceback
+from Queue import Empty
+from decanter_new import HTTPRequest, _rows
+
+# Messages sent to the shard processes.
+_REQUESTS, _FLUSH, _STOP = 'requests', 'flush', 'stop'
+
+# Window of the alerts raised by a shard while the window is open (see Aggregator.early_fire).
+_EARLY = 'early'
+
+
+class ShardError(Exception):
+    """ Raised when a shard process fails, with the traceback of the failure. """
+    pass
+
+
+class ShardedAggregator:
+    """
+    Test HTTP requests with several processes, each aggregating the requests of part of the hosts.
+
+    Fingerprints are independent per host (orig_ip), so the requests are
+    partitioned by the hash of their orig_ip among the shard processes. Each
+    shard is a copy of a trained Aggregator, and clusters, labels, fingerprints
+    and tests the requests of its hosts. Time windows are kept by this process:
+    when one is closed all the shards flush it, and the alerts are collected
+    window by window, in the order of the windows. With early_fire, the
+    alerts a shard raises while a window is open are reported as soon as they
+    are received.
+
+    Trained fingerprints and known browsers are shared with the shards when
+    they are started (the processes are forked), and read-only afterwards.
+    Unlike a single Aggregator, each shard keeps the referrer graphs of the
+    user-agents of its own hosts. The memory bounds of the Aggregator
+    (max_clusters and max_graphs) are split evenly among the shards, so that
+    all the shards together keep at most as many clusters and graphs.
+    """
+
+    def __init__(self, aggregator, shards, batch_size=500, max_batches=16):
+        """
+            Parameters
+            -------------
+            aggregator : Aggregator
+                Trained Aggregator in Testing and online mode. Alerts are
+                appended to its alerts, and passed to its on_alert.
+
+            shards : int
+                Number of shard processes.
+
+            batch_size : int, default = 500
+                Requests sent at once to a shard.
+
+            max_batches : int, default = 16
+                Batches waiting to be processed by a shard, before the reader
+                waits for it.
+        """
+        if aggregator.mode != 1 or aggregator.offline != 0:
+            raise ValueError('Only an Aggregator in Testing and online mode can be sharded.')
+        if aggregator.window != 'global':
+            raise ValueError('Only an Aggregator with global time windows can be sharded.')
+        self.aggregator = aggregator
+        self.shards = shards
+        self.batch_size = batch_size
+        self.time_start = None
+        self.time_current = None
+
+        # Requests not yet sent to each shard
+        self.batches = [[] for _ in range(shards)]
+
+        # Windows closed and not yet collected, and the results received for them.
+        self.window = 0
+        self.collected = 0
+        self.results = {}
+        self.failed = False
+
+        self.output = multiprocessing.Queue()
+        self.inputs = [multiprocessing.Queue(max_batches) for _ in range(shards)]
+        self.processes = [multiprocessing.Process(target=_shard, args=(aggregator, i, shards, q, self.output))
+                          for i, q in enumerate(self.inputs)]
+        for p in self.processes:
+            p.daemon = True
+            p.start()
+
+
+    def analyze_log(self, data):
+        """
+            Test the HTTP requests of a Dataframe or a stream of rows (see Aggregator.analyze_log)
+
+            Parameter
+            -------------
+            data : pandas Dataframe, or iterable of dict
+        """
+        try:
+            for row in _rows(data):
+                self._test_row(row)
+            self.flush()
+        finally:
+            self.close()
+
+
+    def follow(self, data):
+        """
+            Test an unbounded stream of rows (see Aggregator.follow)
+
+            Parameter
+            -------------
+            data : iterable of dict, or None
+        """
+        last_ts = None
+        for row in data:
+            if row is not None:
+                self._test_row(row)
+                last_ts, last_seen = row['ts'], time.time()
+            elif last_ts is not None and self.time_start is not None:
+                self.advance_time(last_ts + datetime.timedelta(seconds=time.time() - last_seen))
+            self._collect(block=False)
+
+
+    def _test_row(self, row):
+        """ Send a row to the shard of its host, closing the time window if the timeout is expired. """
+        if self.time_start is None:
+            self.time_start = row['ts']
+
+        shard = hash(row['id.orig_h']) % self.shards
+        self.batches[shard].append(row)
+        if len(self.batches[shard]) >= self.batch_size:
+            self._send(shard)
+
+        self.advance_time(row['ts'])
+
+
+    def advance_time(self, ts):
+        """
+            Set the current time, closing the time window if the timeout is expired.
+
+            Parameter
+            -------------
+            ts : datetime
+        """
+        self.time_current = ts
+        if self.time_start is not None and (self.time_current - self.time_start) > self.aggregator.timeout:
+            self.flush()
+
+
+    def flush(self):
+        """
+            Close the time window: every shard tests the fingerprints of its aggregated requests.
+        """
+        for i in range(self.shards):
+            self._send(i)
+            self.inputs[i].put((_FLUSH, (self.window, self.time_current)))
+        self.window += 1
+        self.time_start = None
+        self._collect(block=False)
+
+
+    def close(self):
+        """
+            Collect the alerts of all the closed windows and stop the shard processes.
+        """
+        if not self.processes:
+            return
+        try:
+            # After a failure the alerts of the windows left are never received.
+            if not self.failed:
+                self._collect(block=True)
+        finally:
+            for q in self.inputs:
+                q.put((_STOP, None))
+            for p in self.processes:
+                p.join()
+            self.processes = []
+
+
+    def _send(self, shard):
+        if self.batches[shard]:
+            self.inputs[shard].put((_REQUESTS, self.batches[shard]))
+            self.batches[shard] = []
+
+
+    def _collect(self, block):
+        """ Receive the results of the shards, and report the alerts of the windows all the shards have tested. """
+        while self.collected < self.window:
+            try:
+                window, shard, alerts = self.output.get(block)
+            except Empty:
+                return
+            if window is None:
+                self.failed = True
+                raise ShardError('Shard {} failed:\n{}'.format(shard, alerts))
+            if window == _EARLY:
+                self._report(alerts)
+                continue
+            self.results.setdefault(window, {})[shard] = alerts
+
+            while len(self.results.get(self.collected, ())) == self.shards:
+                results = self.results.pop(self.collected)
+                for i in range(self.shards):
+                    self._report(results[i])
+                self.collected += 1
+
+
+    def _report(self, alerts):
+        for alert in alerts:
+            self.aggregator.alerts.append(alert)
+            if self.aggregator.on_alert is not None:
+                self.aggregator.on_alert(alert)
+
+
+def _shard(aggregator, index, shards, requests, output):
+    """ Main loop of a shard process of ShardedAggregator """
+    # Interrupts are handled by the parent process, that closes the shards.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    aggregator.on_alert = None
+    # Each shard keeps its share of the clusters and referrer graphs.
+    if aggregator.max_clusters is not None:
+        aggregator.max_clusters = -(-aggregator.max_clusters // shards)
+    if aggregator.max_graphs is not None:
+        aggregator.max_graphs = -(-aggregator.max_graphs // shards)
+    try:
+        while True:
+            command, value = requests.get()
+            if command == _REQUESTS:
+                for row in value:
+                    h = HTTPRequest(row)
+                    aggregator.time_current = h.ts
+                    aggregator._insert_http_request(h)
+                    if aggregator.early_fire:
+                        aggregator._early_check(h)
+                if aggregator.alerts:
+                    output.put((_EARLY, index, aggregator.alerts))
+                    aggregator.alerts = []
+            elif command == _FLUSH:
+                window, aggregator.time_current = value
+                aggregator.alerts = []
+                aggregator.flush()
+                output.put((window, index, aggregator.alerts))
+            else:
+                return
+    except Exception:
+        output.put((None, index, traceback.format_exc()))
+        # Keep reading, so that the parent process is never blocked sending requests.
+        while requests.get()[0] != _STOP:
+            pass